@@ -0,0 +1,146 @@
+"""
+Vectorized decoding of raw ADC words
+
+An AdcFormat describes how samples sit in the raw words read from the
+hardware: bit width, offset binary or two's complement coding, how many
+samples are packed into one word and how channels are interleaved.
+toInt() / toFloat() decode a whole uint16 / uint32 buffer with numpy,
+no python loops.
+
+try:
+ python3 adc_formats.py bench
+"""
+from sys import argv, byteorder
+from time import perf_counter
+import numpy as np
+
+
+class AdcFormat:
+    def __init__(
+        self, bits=16, coding="offset", container=16, justify="msb",
+        per_word=1, channels=1, interleaved=False
+    ):
+        """
+        bits
+            valid bits of one sample
+        coding
+            "offset" (offset binary) or "twos" (two's complement)
+        container
+            bits occupied by one sample in the raw word
+        justify
+            "msb" if the valid bits are the upper ones of the container
+        per_word
+            samples packed into one raw word, the first in the LSBs
+        channels, interleaved
+            if interleaved, consecutive samples belong to consecutive
+            channels and the result has the shape (channels, N)
+        """
+        if coding not in ("offset", "twos"):
+            raise ValueError("coding must be offset or twos")
+        if bits > 16 or bits > container:
+            raise ValueError("need bits <= min(16, container)")
+        self.bits = bits
+        self.coding = coding
+        self.container = container
+        self.justify = justify
+        self.per_word = per_word
+        self.channels = channels
+        self.interleaved = interleaved
+        self.scale = 1 / (1 << (bits - 1))
+
+    def unpack(self, raw):
+        """ split raw words into one container per sample """
+        raw = np.asarray(raw)
+        if self.per_word == 1 and raw.itemsize * 8 == self.container:
+            return raw
+        if self.per_word * self.container == raw.itemsize * 8 and \
+                self.container in (8, 16) and byteorder == "little" and \
+                raw.dtype.isnative and raw.flags.c_contiguous:
+            # samples are already in memory order, no copy
+            return raw.view("u{:d}".format(self.container // 8))
+        shifts = np.arange(self.per_word, dtype=raw.dtype) * self.container
+        mask = raw.dtype.type((1 << self.container) - 1)
+        x = (raw[..., None] >> shifts) & mask
+        return x.reshape(raw.shape[:-1] + (-1,))
+
+    def deinterleave(self, x):
+        if self.channels > 1 and self.interleaved:
+            return x.reshape(x.shape[:-1] + (-1, self.channels)).swapaxes(-1, -2)
+        return x
+
+    def toInt(self, raw):
+        """ raw words --> signed int16 samples """
+        x = self.unpack(raw)
+        if self.bits == 16 and self.container == 16:
+            # no shifting needed, reinterpret the bits
+            x = x.astype(np.uint16, copy=False)
+            if self.coding == "offset":
+                x = x ^ np.uint16(0x8000)
+            return self.deinterleave(x.view(np.int16))
+        x = x.astype(np.int32)
+        if self.justify == "msb":
+            x >>= self.container - self.bits
+        x &= (1 << self.bits) - 1
+        s = 1 << (self.bits - 1)
+        if self.coding == "twos":
+            x ^= s
+        x -= s
+        return self.deinterleave(x.astype(np.int16))
+
+    def toFloat(self, raw, out=None):
+        """ raw words --> float32 in full scale, -1 <= val < 1 """
+        x = self.toInt(raw)
+        if out is None:
+            out = np.empty(x.shape, dtype=np.float32)
+        np.multiply(x, self.scale, out=out)
+        return out
+
+
+FORMATS = {
+    # what hello_LTC.py stores: one offset binary sample per word
+    "offset_binary": AdcFormat(16, "offset"),
+    "twos_complement": AdcFormat(16, "twos"),
+    # LTC2175-14, MSB aligned in 16 bits
+    "ltc2175": AdcFormat(14, "offset", 16, "msb"),
+    # two 16 bit offset binary samples per 32 bit word
+    "offset_binary_packed": AdcFormat(16, "offset", 16, "msb", 2),
+    "ltc2175_packed": AdcFormat(14, "offset", 16, "msb", 2)
+}
+
+
+def bench(N=10000000):
+    """ compare against the helpers in common.py on N samples """
+    from common import twos_comp, twos_comps
+    raw32 = np.random.randint(0, 1 << 16, N, dtype=np.uint32)
+    raw16 = raw32.astype(np.uint16)
+    res = []
+
+    def t(name, f, n=N):
+        t0 = perf_counter()
+        f()
+        dt = perf_counter() - t0
+        res.append((name, dt * N / n))
+        print("{:40s} {:8.3f} s  {:8.1f} MS/s".format(name, dt * N / n, n / dt / 1e6))
+
+    print("{:d} samples".format(N))
+    # scalar, extrapolated from 1 % of the samples
+    n = N // 100
+    t("twos_comp() loop (extrapolated)", lambda: [twos_comp(int(v), 16) for v in raw32[:n]], n)
+    t("twos_comps()", lambda: twos_comps(raw32.astype(np.int64), 16))
+    t("getSamples(): raw / (1 << 15) - 1", lambda: raw32 / (1 << 15) - 1)
+    fmt = FORMATS["offset_binary"]
+    out = np.empty(N, dtype=np.float32)
+    t("offset_binary toInt(uint16)", lambda: fmt.toInt(raw16))
+    t("offset_binary toInt(uint32)", lambda: fmt.toInt(raw32))
+    t("offset_binary toFloat(uint16, out)", lambda: fmt.toFloat(raw16, out))
+    t("ltc2175 toFloat(uint16, out)", lambda: FORMATS["ltc2175"].toFloat(raw16, out))
+    packed = raw16.view(np.uint32)
+    t("offset_binary_packed toFloat(uint32)", lambda: FORMATS["offset_binary_packed"].toFloat(packed))
+    return res
+
+
+if __name__ == '__main__':
+    if "bench" not in argv:
+        print(__doc__)
+        exit(-1)
+    bench()
@@ -1,8 +1,25 @@
-from sys import argv, exit
+from sys import argv, exit, executable
 from litex.soc.integration.builder import Builder
 from litex import RemoteClient
+from litex.soc.tools.remote.etherbone import EtherbonePacket, EtherboneRecord
+from litex.soc.tools.remote.etherbone import EtherboneReads, EtherboneWrites
+from litex.soc.tools.remote.etherbone import etherbone_packet_header_length
+from litex.soc.tools.remote.etherbone import etherbone_record_header_length
 from os import system
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import RLock
+from contextlib import nullcontext
+import socket
+import subprocess
+import hashlib
+import json
+import os
 from struct import pack, unpack
+from collections import deque
+from datetime import datetime
+import re
+# numpy, adc_formats and recorder are imported where needed, so
+# gateware scripts don't depend on them
 # from numpy import *
 # from matplotlib.pyplot import *
 # from scipy.signal import *
@@ -89,33 +106,194 @@ class LedBlinker(Module):
         ]
 
 
+BUILD_CACHE = "build/.build_cache.json"
+STAGE_DIR = "build/.stage"
+# comment lines with a date / "generated by" stamp, differ on every build
+_STAMP_LINE = re.compile(
+    rb"^\s*(//|#|--|/\*).*(generated|\d{4}-\d\d-\d\d).*$\n?", re.M | re.I
+)
+
+
+def _isInitOf(data, init):
+    """ is `data` a hex memory init file with the content `init` """
+    try:
+        vals = [int(l, 16) for l in data.split()]
+    except ValueError:
+        return False
+    return vals[:len(init)] == list(init) and not any(vals[len(init):])
+
+
+def _toolchainOpts(soc, **kwargs):
+    """ json of the platform / toolchain settings which affect a build """
+    p = soc.platform
+    opts = {
+        "platform": type(p).__name__,
+        "device": getattr(p, "device", None),
+        "kwargs": kwargs
+    }
+    for k, v in getattr(getattr(p, "toolchain", None), "__dict__", {}).items():
+        try:
+            opts[k] = json.loads(json.dumps(v))
+        except (TypeError, ValueError):
+            pass  # objects / functions, can't hash them reliably
+    return json.dumps(opts, sort_keys=True, default=str)
+
+
+def buildInputs(soc, gwDir, **kwargs):
+    """
+    sha1 of each generated gateware file in gwDir (verilog, constraints,
+    memory init files) and of the toolchain options.
+    The identifier memory and date stamps are left out, as they change
+    on every build.
+    """
+    ident = getattr(getattr(soc, "identifier", None), "mem", None)
+    ident = [] if ident is None else ident.init
+    inputs = {}
+    for fName in sorted(os.listdir(gwDir)):
+        path = os.path.join(gwDir, fName)
+        if not os.path.isfile(path):
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        if fName.endswith(".init") and ident and _isInitOf(data, ident):
+            continue
+        inputs[fName] = hashlib.sha1(_STAMP_LINE.sub(b"", data)).hexdigest()
+    opts = _toolchainOpts(soc, **kwargs).encode()
+    inputs["<toolchain>"] = hashlib.sha1(opts).hexdigest()
+    key = hashlib.sha1(json.dumps(inputs, sort_keys=True).encode())
+    return key.hexdigest(), inputs
+
+
+def _loadCache():
+    try:
+        with open(BUILD_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _saveCache(cache, tName, step, key, inputs):
+    """ remember the build inputs of `step`, returns the ones which changed """
+    old = cache.get(tName, {}).get(step, {}).get("inputs", {})
+    changed = sorted(
+        k for k in set(old) | set(inputs) if old.get(k) != inputs.get(k)
+    )
+    cache.setdefault(tName, {})[step] = {
+        "hash": key,
+        "inputs": inputs,
+        "changed": changed,
+        "time": datetime.now().isoformat()
+    }
+    _writeCache(cache)
+    return changed
+
+
+def _writeCache(cache):
+    os.makedirs(os.path.dirname(BUILD_CACHE), exist_ok=True)
+    with open(BUILD_CACHE, "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+
+
+def _syncStage(stageDir, outDir):
+    """ copy a staged build over the real one """
+    import shutil
+    for root, dirs, files in os.walk(stageDir):
+        dst = os.path.join(outDir, os.path.relpath(root, stageDir))
+        os.makedirs(dst, exist_ok=True)
+        for fName in files:
+            shutil.copy2(os.path.join(root, fName), os.path.join(dst, fName))
+
+
+def _stage(soc, tName, **buildKw):
+    """
+    generate everything into STAGE_DIR (no toolchain run),
+    returns vns and the hash of the build inputs
+    """
+    builder = Builder(
+        soc, output_dir=STAGE_DIR,
+        csr_csv=STAGE_DIR + "/csr.csv",
+        csr_json=STAGE_DIR + "/csr.json",
+        compile_gateware=False, compile_software=False
+    )
+    vns = builder.build(build_name=tName, **buildKw)
+    key, inputs = buildInputs(
+        soc, os.path.join(STAGE_DIR, "gateware"), **buildKw
+    )
+    return vns, key, inputs
+
+
+def _synthChild(useCache):
+    """
+    run the synth step of this script in a new process. A SoC object can
+    only be built once (the platform can't be finalized twice).
+    """
+    skip = ("build", "config", "sim", "nocache")
+    args = [a for a in argv[1:] if a not in skip]
+    if not useCache:
+        args.append("nocache")
+    ret = subprocess.call([executable, argv[0]] + args)
+    if ret != 0:
+        exit(ret)
+
+
 def main(soc, doc='', **kwargs):
-    """ generic main function for litex modules """
+    """
+    generic main function for litex modules
+
+    build and synth are skipped if the generated verilog, constraints,
+    memory init files and toolchain options did not change since the last
+    time (see BUILD_CACHE). Add `nocache` to the arguments to force them.
+
+    The SoC is built only once per call: with `synth` the sources are
+    generated with the synth options, hashed, and only on a change the
+    toolchain runs, in a child process (`synth nocache`).
+    With `build synth` the synth step always runs in a child process.
+    """
     print(argv, kwargs)
     if len(argv) < 2:
         print(doc)
         exit(-1)
     tName = argv[0].replace(".py", "")
     vns = None
+    useCache = "nocache" not in argv
     if 'sim' in argv:
         run_simulation(
             soc,
             vcd_name=tName + '.vcd',
             **kwargs
         )
+    cache = _loadCache()
     if "build" in argv:
-        builder = Builder(
-            soc, output_dir="build",
-            csr_csv="build/csr.csv",
-            csr_json="build/csr.json",
-            compile_gateware=False, compile_software=False
+        # generate everything into a staging directory, only touch
+        # build/ if something changed. Keeps timestamps for make
+        vns, key, inputs = _stage(
+            soc, tName, regular_comb=False, blocking_assign=True
         )
-        vns = builder.build(
-            build_name=tName, regular_comb=False, blocking_assign=True
-        )
-        # Ugly workaround as I couldn't get vpath to work :(
-        system('cp ./build/gateware/mem*.init .')
-    if "synth" in argv:
+        prev = cache.get(tName, {}).get("build", {}).get("hash")
+        if useCache and key == prev:
+            print("build: up to date ({:})".format(key[:8]))
+        else:
+            _syncStage(STAGE_DIR, "build")
+            changed = _saveCache(cache, tName, "build", key, inputs)
+            print("build: changed:", ", ".join(changed))
+            # Ugly workaround as I couldn't get vpath to work :(
+            system('cp ./build/gateware/mem*.init .')
+        if "synth" in argv:
+            _synthChild(useCache)
+    elif "synth" in argv and useCache:
+        # same conversion options as the real synth below
+        vns, key, inputs = _stage(soc, tName)
+        prev = cache.get(tName, {}).get("synth", {}).get("hash")
+        bitFile = "build/gateware/{:}.bit".format(tName)
+        if key == prev and os.path.isfile(bitFile):
+            print("synth: up to date ({:}), keeping {:}".format(key[:8], bitFile))
+        else:
+            _synthChild(useCache)
+            # build/gateware was rewritten with the synth settings
+            cache.get(tName, {}).pop("build", None)
+            changed = _saveCache(cache, tName, "synth", key, inputs)
+            print("synth: changed:", ", ".join(changed))
+    elif "synth" in argv:
         builder = Builder(
             soc, output_dir="build",
             csr_csv="build/csr.csv",
@@ -123,6 +301,11 @@ def main(soc, doc='', **kwargs):
             compile_gateware=True, compile_software=True
         )
         vns = builder.build(build_name=tName)
+        # inputs not hashed, don't trust the old entries.
+        # A parent process (cached synth) stores the new one.
+        cache.get(tName, {}).pop("build", None)
+        cache.get(tName, {}).pop("synth", None)
+        _writeCache(cache)
     if "config" in argv:
         prog = soc.platform.create_programmer()
         prog.load_bitstream("build/gateware/{:}.bit".format(tName))
@@ -134,35 +317,412 @@ def main(soc, doc='', **kwargs):
     return vns
 
 
+# append to the ident of a SoC and call stampCsrHash() from its
+# do_finalize(), so getIdInfo() can check csr.csv against the bitstream
+CSR_HASH_TAG = " csr:00000000"
+
+
+def csrMapHash(csv):
+    """ 8 hex digits of sha1 over the csr_base / csr_register lines of a csr.csv """
+    lines = [
+        ll.strip() for ll in csv.splitlines()
+        if ll.startswith(("csr_base,", "csr_register,"))
+    ]
+    return hashlib.sha1("\n".join(lines).encode()).hexdigest()[:8]
+
+
+def stampCsrHash(soc):
+    """
+    replace the CSR_HASH_TAG placeholder in the identifier memory by the
+    hash of the final CSR map. Call it at the end of do_finalize().
+    """
+    from litex.soc.integration.cpu_interface import get_csr_csv
+    csv = get_csr_csv(
+        soc.get_csr_regions(), soc.get_constants(), soc.get_memory_regions()
+    )
+    init = list(soc.identifier.mem.init)
+    tag = list(CSR_HASH_TAG.encode())
+    new = list(CSR_HASH_TAG.replace("00000000", csrMapHash(csv)).encode())
+    for i in range(len(init) - len(tag) + 1):
+        if init[i:i + len(tag)] == tag:
+            init[i:i + len(tag)] = new
+            soc.identifier.mem.init = init
+            return
+    raise ValueError("stampCsrHash: no CSR_HASH_TAG in the ident")
+
+
 #-----------------------
 # litex_server stuff
 #-----------------------
+def getIdInfo(r):
+    """
+    ident string, build time and CSR map hash of the connected bitstream.
+    The identifier memory is read in one burst, once per connection.
+
+    csr_mismatch is True if the CSR map hash in the ident (see
+    stampCsrHash()) differs from the one of the local csr.csv,
+    None if the bitstream has no hash or csr.csv is missing.
+    """
+    import numpy as np
+    info = getattr(r, "idInfo", None)
+    if info is not None:
+        return info
+    words = readPipelined(r, r.bases.identifier_mem, 64)
+    chars = (words & 0xFF).astype(np.uint8)
+    zeros = np.flatnonzero(chars == 0)
+    if len(zeros) > 0:
+        chars = chars[:zeros[0]]
+    ident = chars.tobytes().decode(errors="replace")
+    info = {
+        "ident": ident, "build_time": None,
+        "csr_hash": None, "csr_hash_local": None, "csr_mismatch": None
+    }
+    # ident_version=True appends the build date
+    m = re.search(r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})$", ident)
+    if m:
+        info["build_time"] = datetime.strptime(m.group(1), "%Y-%m-%d %H:%M:%S")
+    m = re.search(r"csr:([0-9a-f]{8})\b", ident)
+    if m:
+        info["csr_hash"] = m.group(1)
+    csr_csv = getattr(r, "csr_csv", None)
+    if csr_csv is not None and os.path.isfile(csr_csv):
+        with open(csr_csv) as f:
+            info["csr_hash_local"] = csrMapHash(f.read())
+    if info["csr_hash"] is not None and info["csr_hash_local"] is not None:
+        info["csr_mismatch"] = info["csr_hash"] != info["csr_hash_local"]
+    r.idInfo = info
+    return info
+
+
 def getId(r):
-    s = ""
-    for i in range(64):
-        temp = r.read(r.bases.identifier_mem + i * 4)
-        if temp == 0:
-            break
-        s += chr(temp & 0xFF)
-    return s
+    return getIdInfo(r)["ident"]
 
 
-def conLitexServer(csr_csv="build/csr.csv", port=1234):
-    for i in range(32):
-        try:
-            r = RemoteClient(csr_csv=csr_csv, debug=False, port=port + i)
-            r.open()
-            print("Connected to Port", 1234 + i)
-            break
-        except ConnectionRefusedError:
-            r = None
-    if r:
-        print(getId(r))
+# byte offset of the first data word in an etherbone read response
+# (packet header, record header, base return address)
+EB_DATA_OFFSET = \
+    etherbone_packet_header_length + etherbone_record_header_length + 4
+
+
+def linkLock(r):
+    """
+    the lock of a shared connection (see conLitexServer()),
+    hold it from sending a request until its response has been received
+    """
+    lock = getattr(r, "lock", None)
+    return nullcontext() if lock is None else lock
+
+
+def sendReadAddrs(r, addrs):
+    """ send a single etherbone read request for <= 255 addresses, don't wait """
+    record = EtherboneRecord()
+    record.reads = EtherboneReads(addrs=list(addrs))
+    record.rcount = len(addrs)
+    packet = EtherbonePacket()
+    packet.records = [record]
+    packet.encode()
+    r.socket.sendall(bytes(packet))
+
+
+def sendReads(r, addr, N):
+    """ send a single etherbone read request for N <= 255 words, don't wait """
+    sendReadAddrs(r, [addr + i * 4 for i in range(N)])
+
+
+def recvReads(r, N):
+    """ receive the response to a single read request as uint32 array """
+    import numpy as np
+    packet = r.receive_packet(r.socket)
+    return np.frombuffer(packet, ">u4", N, EB_DATA_OFFSET)
+
+
+def readAddrs(r, addrs):
+    """ read a list of (not necessarily consecutive) addresses in one go """
+    with linkLock(r):
+        sendReadAddrs(r, addrs)
+        return recvReads(r, len(addrs))
+
+
+def readPipelined(r, addr, N, out=None, window=8, chunk=255):
+    """
+    read N 32 bit words starting at byte address addr
+
+    splits the read into requests of `chunk` words and keeps up to `window`
+    of them in flight at once. litex_server answers in order, so the
+    responses are written straight into `out` (a new uint32 array if None).
+    With window=1 this is the same as calling r.read() in a loop.
+
+    addr can also be a list of base addresses, then N words are read from
+    each of them in one go and `out` has the shape (len(addr), N).
+    """
+    import numpy as np
+    if isinstance(addr, int):
+        addrs = [addr]
+        shape = (N,)
     else:
+        addrs = list(addr)
+        shape = (len(addrs), N)
+    if out is None:
+        out = np.empty(shape, dtype=np.uint32)
+    flat = out.reshape(-1)  # a view, as long as out is contiguous
+    # (offset into flat, address, length) of all requests
+    reqs = (
+        (k * N + o, a + o * 4, min(chunk, N - o))
+        for k, a in enumerate(addrs) for o in range(0, N, chunk)
+    )
+    pending = deque()
+    with linkLock(r):
+        for req in reqs:
+            if len(pending) >= window:
+                i, n = pending.popleft()
+                flat[i: i + n] = recvReads(r, n)
+            i, a, n = req
+            sendReads(r, a, n)
+            pending.append((i, n))
+        while pending:
+            i, n = pending.popleft()
+            flat[i: i + n] = recvReads(r, n)
+    return out
+
+
+# open RemoteClients, shared by all tools in this process
+_links = {}
+# last working port and csr.csv for each project directory
+LAST_PORTS = os.path.expanduser("~/.litex_server_ports.json")
+
+
+def _loadLastPorts():
+    try:
+        with open(LAST_PORTS) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _saveLastPort(project, port, csr_csv):
+    last = _loadLastPorts()
+    last[project] = {"port": port, "csr_csv": csr_csv}
+    try:
+        with open(LAST_PORTS, "w") as f:
+            json.dump(last, f, indent=2)
+    except OSError as e:
+        print("could not save last port:", e)
+
+
+def _probe(host, port, timeout=0.2):
+    """ True if something is listening on host:port """
+    try:
+        socket.create_connection((host, port), timeout).close()
+        return True
+    except OSError:
+        return False
+
+
+def findPort(host="localhost", port=1234, n=32, timeout=0.2):
+    """ probe ports port .. port + n - 1 concurrently, returns the lowest open one """
+    with ThreadPoolExecutor(n) as ex:
+        res = list(ex.map(lambda p: _probe(host, p, timeout), range(port, port + n)))
+    for i, isOpen in enumerate(res):
+        if isOpen:
+            return port + i
+    return None
+
+
+def conLitexServer(csr_csv=None, port=None, host="localhost"):
+    """
+    connect to litex_server, or return the already open connection
+    to it, so several tools in one process share a single link.
+
+    Tries the last working port of this project (the current directory)
+    first, then probes port .. port + 31 concurrently (port=1234 if None).
+    csr_csv defaults to the last one used, or build/csr.csv.
+
+    The returned RemoteClient has a `lock` (RLock), hold it when sharing
+    the link between threads.
+    """
+    project = os.getcwd()
+    last = _loadLastPorts().get(project, {})
+    if csr_csv is None:
+        csr_csv = last.get("csr_csv", "build/csr.csv")
+    csr_csv = os.path.abspath(csr_csv)
+    key = (host, csr_csv)
+    if key in _links:
+        return _links[key]
+    p = None
+    if port is None and "port" in last and _probe(host, last["port"]):
+        p = last["port"]
+    if p is None:
+        p = findPort(host, 1234 if port is None else port)
+    if p is None:
         print("Could not connect to RemoteClient")
+        return None
+    r = RemoteClient(host=host, csr_csv=csr_csv, debug=False, port=p)
+    r.open()
+    r.lock = RLock()
+    r.csr_csv = csr_csv
+    print("Connected to Port", p)
+    info = getIdInfo(r)
+    print(info["ident"])
+    if info["csr_mismatch"]:
+        print("Warning: {:} does not match the CSR map of the running bitstream ({:})".format(
+            csr_csv, info["build_time"]
+        ))
+    _saveLastPort(project, p, csr_csv)
+    _links[key] = r
     return r
 
 
+def closeLitexServer(r):
+    """ close a connection from conLitexServer() for all its users """
+    for k, v in list(_links.items()):
+        if v is r:
+            del _links[k]
+    r.close()
+
+
+def sendWrites(r, writes):
+    """
+    send a list of (addr, word) writes in order, with one sendall().
+    Writes to consecutive addresses are merged into one etherbone record.
+    """
+    runs = []
+    for addr, word in writes:
+        if runs and addr == runs[-1][0] + 4 * len(runs[-1][1]):
+            runs[-1][1].append(word)
+        else:
+            runs.append((addr, [word]))
+    buf = b""
+    for addr, words in runs:
+        record = EtherboneRecord()
+        record.writes = EtherboneWrites(base_addr=addr, datas=iter(words))
+        record.wcount = len(words)
+        packet = EtherbonePacket()
+        packet.records = [record]
+        packet.encode()
+        buf += bytes(packet)
+    with linkLock(r):
+        r.socket.sendall(buf)
+    return len(runs)
+
+
+class ShadowRegs:
+    """
+    write-combining shadow of r.regs
+
+    rs = getShadow(r)
+    rs.spi_config.write(x)  # dropped if x is what we wrote before
+    rs.spi_start.strobe()   # always written, never cached
+    rs.flush()              # send all queued writes in one go
+    rs.spi_miso_data.read() # flushes first, so the read sees the writes
+
+    Values written to `rw` registers are cached and read back from the
+    cache. Plain CSRs (strobes, like spi_start) look like `rw` registers
+    in csr.csv, write them with strobe() instead of write().
+    With autoflush=True every write goes out immediately (no batching).
+    """
+    def __init__(self, r, autoflush=False):
+        self.r = r
+        self.autoflush = autoflush
+        self.cache = {}
+        self.pending = []
+        # statistics
+        self.nWrites = 0   # writes requested
+        self.nSkipped = 0  # writes dropped as they didn't change anything
+        self.nPackets = 0  # etherbone write packets sent
+        self.nReads = 0    # reads which went over the link
+
+    def __getattr__(self, name):
+        return _ShadowReg(self, name)
+
+    def _reg(self, name):
+        return getattr(self.r.regs, name)
+
+    def write(self, name, value):
+        self.nWrites += 1
+        if self.cache.get(name) == value:
+            self.nSkipped += 1
+            return
+        self._queue(name, value)
+        self.cache[name] = value
+        if self.autoflush:
+            self.flush()
+
+    def strobe(self, name, value=1):
+        """ queue a write to a strobe CSR (like spi_start), always sent """
+        self.nWrites += 1
+        self._queue(name, value)
+        if self.autoflush:
+            self.flush()
+
+    def _queue(self, name, value):
+        reg = self._reg(name)
+        n = getattr(reg, "length", 1)
+        dw = getattr(reg, "data_width", 32)
+        # multi word CSRs are MSB first
+        for i in range(n):
+            self.pending.append((
+                reg.addr + i * 4,
+                (value >> (dw * (n - 1 - i))) & ((1 << dw) - 1)
+            ))
+
+    def read(self, name):
+        reg = self._reg(name)
+        if getattr(reg, "mode", "ro") == "rw" and name in self.cache:
+            return self.cache[name]
+        with linkLock(self.r):
+            self.flush()
+            self.nReads += 1
+            value = reg.read()
+        if getattr(reg, "mode", "ro") == "rw":
+            self.cache[name] = value
+        return value
+
+    def flush(self):
+        """ send all queued writes, don't wait """
+        if self.pending:
+            self.nPackets += sendWrites(self.r, self.pending)
+            self.pending = []
+
+    def barrier(self):
+        """ flush and wait until all writes have arrived at the hardware """
+        with linkLock(self.r):
+            self.flush()
+            # litex_server handles requests in order, a read can only return
+            # after all writes before it have been done
+            self.r.read(self.r.bases.identifier_mem)
+        self.nReads += 1
+
+    def invalidate(self, name=None):
+        """ forget cached values (all if name is None) """
+        if name is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(name, None)
+
+
+class _ShadowReg:
+    """ one register of ShadowRegs, same interface as r.regs.<name> """
+    def __init__(self, shadow, name):
+        self.shadow = shadow
+        self.name = name
+
+    def write(self, value):
+        self.shadow.write(self.name, value)
+
+    def strobe(self, value=1):
+        self.shadow.strobe(self.name, value)
+
+    def read(self):
+        return self.shadow.read(self.name)
+
+
+def getShadow(r):
+    """ the ShadowRegs of a connection, shared by all its users """
+    if getattr(r, "shadow", None) is None:
+        r.shadow = ShadowRegs(r)
+    return r.shadow
+
+
 class LTC_SPI:
     # config bits
     OFFLINE = 0  # all pins high-z (reset=1)
@@ -177,32 +737,132 @@ class LTC_SPI:
     CS_MASK = 0  # Active high bit mask of chip selects to assert (reset=0)
     WRITE_LENGTH = 16  # How many bits to write and ...
     READ_LENGTH = 24  # when to switch over in half duplex mode
+    # LTC2175 register map, A0 (reset) is write only
+    REGS = {
+        "reset": 0,             # [7] software reset
+        "power_down": 1,        # [7] DCSOFF, [6] RAND, [5] TWOSCOMP, [4:0] SLEEP / NAP
+        "output_mode": 2,       # [7:5] ILVDS, [4] TERMON, [3] OUTOFF, [2:0] OUTMODE
+        "test_pattern_msb": 3,  # [7] OUTTEST, [5:0] TP[13:8]
+        "test_pattern_lsb": 4   # [7:0] TP[7:0]
+    }
+    READABLE = ("power_down", "output_mode", "test_pattern_msb", "test_pattern_lsb")
+    # power-up table: software reset, test pattern off, randomizer off,
+    # offset binary. Also the default of the gateware init sequencer.
+    INIT = [("reset", 0x80), ("test_pattern_msb", 0x00), ("power_down", 0x00)]
 
     def __init__(self, r):
         self.r = r
-        r.regs.spi_config.write(
+        # redundant config writes are dropped, transfers go out in one packet
+        self.regs = getShadow(r)
+        self.regs.spi_config.write(
             (0xFF << LTC_SPI.DIV_WRITE) |
             (0xFF << LTC_SPI.DIV_READ)
         )
         # 16 bit write transfer (includes read as is 4 wire)
-        r.regs.spi_xfer.write(
+        self.regs.spi_xfer.write(
             (0 << LTC_SPI.READ_LENGTH) |
             (0x10 << LTC_SPI.WRITE_LENGTH) |
             (0xFFFF << LTC_SPI.CS_MASK)
         )
+        # SPI master status + read data, polled in one request
+        self._poll_addrs = [
+            r.regs.spi_active.addr,
+            r.regs.spi_pending.addr,
+            r.regs.spi_miso_data.addr
+        ]
+
+    def _xfer(self, word):
+        """ start a 16 bit transfer, wait until done, return miso data """
+        self.regs.spi_mosi_data.write(word << 16)
+        self.regs.spi_start.strobe()
+        self.regs.flush()
+        for i in range(100):
+            active, pending, miso = readAddrs(self.r, self._poll_addrs)
+            if not (active or pending):
+                return int(miso)
+        raise RuntimeError("LTC_SPI: transfer did not finish")
+
+    def _adr(self, reg):
+        return LTC_SPI.REGS[reg] if isinstance(reg, str) else reg
+
+    @staticmethod
+    def write_word(reg, val):
+        """ 16 bit SPI word writing val to reg (a number or a name from REGS) """
+        adr = LTC_SPI.REGS[reg] if isinstance(reg, str) else reg
+        return (0 << 15) | ((adr & 0x7F) << 8) | (val & 0xFF)
 
     def set_ltc_reg(self, adr, val):
-        word = (0 << 15) | ((adr & 0x7F) << 8) | (val & 0xFF)
-        word <<= 16
-        self.r.regs.spi_mosi_data.write(word)
-        self.r.regs.spi_start.write(1)
+        """ adr is a number or a name from REGS """
+        self._xfer(LTC_SPI.write_word(adr, val))
 
     def get_ltc_reg(self, adr):
-        word = (1 << 15) | ((adr & 0x7F) << 8)
-        word <<= 16
-        self.r.regs.spi_mosi_data.write(word)
-        self.r.regs.spi_start.write(1)
-        return self.r.regs.spi_miso_data.read() & 0xFF
+        return self._xfer((1 << 15) | ((self._adr(adr) & 0x7F) << 8)) & 0xFF
+
+    def write_regs(self, table):
+        """ program a register table: {name or address: value} or [(reg, value), ...] """
+        items = table.items() if isinstance(table, dict) else table
+        for reg, val in items:
+            self.set_ltc_reg(reg, val)
+
+    def read_regs(self, names=READABLE):
+        """ returns {name: value} """
+        return {n: self.get_ltc_reg(n) for n in names}
+
+    def program(self, table, verify=True):
+        """
+        write a register table, read it back and return the registers
+        which did not stick as {name: (wanted, got)}
+        """
+        self.write_regs(table)
+        if not verify:
+            return {}
+        items = table.items() if isinstance(table, dict) else table
+        names = {v: k for k, v in LTC_SPI.REGS.items()}
+        want = {}
+        for reg, val in items:
+            # addresses without a name in REGS are not read back
+            name = reg if isinstance(reg, str) else names.get(reg)
+            if name in LTC_SPI.READABLE:
+                want[name] = val & 0xFF
+        return LTC_SPI.diff(want, self.read_regs(want.keys()))
+
+    def seq_program(self, table, run=True):
+        """
+        load a register table into the gateware init sequencer (spi_seq)
+        in one burst. It is replayed after every reset, and now if `run`.
+        """
+        items = table.items() if isinstance(table, dict) else table
+        words = [LTC_SPI.write_word(reg, val) for reg, val in items]
+        n_words = self.regs.spi_seq_n_words.read()
+        if len(words) > n_words:
+            raise ValueError("seq_program: {:d} entries, the sequencer holds {:d}".format(
+                len(words), n_words
+            ))
+        base = self.r.bases.spi_seq_table
+        with linkLock(self.r):
+            # already queued writes, then table, length and start, in order
+            self.regs.flush()
+            sendWrites(self.r, [(base + i * 4, w) for i, w in enumerate(words)])
+            self.regs.spi_seq_length.write(len(words))
+            if run:
+                self.regs.spi_seq_start.strobe()
+            self.regs.flush()
+        self.wait_seq()
+
+    def wait_seq(self):
+        """ wait until the init sequencer has released the SPI bus """
+        for i in range(100):
+            if not self.regs.spi_seq_busy_csr.read():
+                return
+        raise RuntimeError("LTC_SPI: init sequencer did not finish")
+
+    @staticmethod
+    def diff(a, b):
+        """ registers which differ between 2 {name: value} tables: {name: (a, b)} """
+        return {
+            k: (a.get(k), b.get(k)) for k in sorted(set(a) | set(b))
+            if a.get(k) != b.get(k)
+        }
 
     def setTp(self, tpValue):
         # Test pattern on + value MSB
@@ -265,34 +925,164 @@ def hd(dat, pad_width=1, word_width=None):
     print()
 
 
+def _pdAddrs(r):
+    """ number of lanes and CSR addresses of a phase detector snapshot """
+    D = 0
+    while hasattr(r.regs, "lvds_pd_phase_{:d}".format(D)):
+        D += 1
+    names = ["lvds_pd_seq", "lvds_pd_period_csr", "lvds_f_sample_value"]
+    names += ["lvds_pd_phase_{:d}".format(i) for i in range(D)]
+    names += ["lvds_id_tap_{:d}".format(i) for i in range(D)]
+    # read the sequence number again to detect a torn snapshot
+    names.append("lvds_pd_seq")
+    return D, [getattr(r.regs, n).addr for n in names]
+
+
+def readPd(r, retries=3):
+    """
+    read a consistent snapshot of the phase detectors in one round trip
+
+    returns a dict of
+      seq:      integration period counter
+      period:   integration period [sample clock cycles]
+      f_sample: measured sample clock frequency [Hz]
+      phase:    phase detector value per lane, -1 < val < 1
+      tap:      IDELAY position per lane, relative to calibration
+    """
+    import numpy as np
+    if not hasattr(r, "pdAddrs"):
+        r.pdAddrs = _pdAddrs(r)
+    D, addrs = r.pdAddrs
+    for i in range(retries):
+        v = readAddrs(r, addrs).astype(np.uint32)
+        if v[0] == v[-1]:
+            break
+    period = max(int(v[1]), 1)
+    return {
+        "seq": int(v[-1]),
+        "period": period,
+        "f_sample": int(v[2]),
+        "phase": v[3: 3 + D].view(np.int32) / period,
+        "tap": v[3 + D: 3 + 2 * D].astype(np.uint8).view(np.int8)
+    }
+
+
 def printPd(r):
     """ read iserdes phase detectors, -1 < val < 1 """
-    integr = r.regs.lvds_pd_period_csr.read()
-    val0 = getInt32(r.regs.lvds_pd_phase_0.read()) / integr
-    val1 = getInt32(r.regs.lvds_pd_phase_1.read()) / integr
-    print("\r{:0.3f}  {:0.3f}          ".format(val0, val1), end="")
-    return val0, val1
+    pd = readPd(r)
+    print("\r" + "  ".join("{:0.3f}".format(v) for v in pd["phase"]) + "          ", end="")
+    return tuple(pd["phase"])
+
+
+def _loadFrames(fName):
+    """
+    frames of a recording (memory-mapped) or .npz dump and a function
+    converting them to full scale
+    """
+    import numpy as np
+    from adc_formats import FORMATS
+    from recorder import Recording
+    if Recording.isRecording(fName):
+        rec = Recording(fName)
+        return rec.raw, rec.toFs
+    npz = np.load(fName)
+    if "raw" in npz:
+        return npz["raw"], FORMATS["offset_binary"].toFloat
+    return npz["dat"], lambda dat: dat
+
+
+def contentHash(fName, cacheDir):
+    """
+    sha1 of the file content (of a dump or recording).
+    Remembered in `cacheDir` as long as size and mtime don't change.
+    """
+    from recorder import Recording
+    if Recording.isRecording(fName):
+        fNames = Recording(fName).files()
+    else:
+        fNames = [fName]
+    stats = [[os.path.abspath(f), os.stat(f).st_size, os.stat(f).st_mtime_ns] for f in fNames]
+    memoName = os.path.join(
+        cacheDir, hashlib.sha1(repr(stats[0][0]).encode()).hexdigest() + ".json"
+    )
+    if os.path.isfile(memoName):
+        with open(memoName) as f:
+            memo = json.load(f)
+        if memo["stats"] == stats:
+            return memo["hash"]
+    h = hashlib.sha1()
+    for fn in fNames:
+        with open(fn, "rb") as f:
+            for b in iter(lambda: f.read(1 << 20), b""):
+                h.update(b)
+    with open(memoName, "w") as f:
+        json.dump({"stats": stats, "hash": h.hexdigest()}, f)
+    return h.hexdigest()
 
 
-def plotNpz(fNames, labels=None, ax=None, fs=120e6, *args, **kwargs):
+def psdNpz(fName, fs=120e6, nfft=2**15, window="hann", cacheDir=None):
     """
-    plot a .npz dump from scope_app.py
+    averaged power spectrum of all frames in a .npz dump or recording.
+    Cached in `cacheDir`, keyed by file content hash, fs, nfft and window.
+    Returns f, Pxx
+    """
+    import numpy as np
+    if cacheDir is None:
+        cacheDir = os.path.join(os.path.dirname(fName), ".psd_cache")
+    os.makedirs(cacheDir, exist_ok=True)
+    cName = os.path.join(cacheDir, "{:}_{:.0f}_{:d}_{:}.npz".format(
+        contentHash(fName, cacheDir), fs, nfft, window
+    ))
+    if os.path.isfile(cName):
+        c = np.load(cName)
+        return c["f"], c["Pxx"]
+    from spectrum import Spectrum
+    frames, toFs = _loadFrames(fName)
+    spec = Spectrum(frames.shape[-1], fs, nfft, window=window)
+    Pxx = 0
+    for i in range(0, len(frames), 256):
+        Pxx = Pxx + spec.blockSum(toFs(frames[i: i + 256]))
+    Pxx = Pxx / len(frames)
+    np.savez(cName, f=spec.f, Pxx=Pxx)
+    return spec.f, Pxx
+
+
+def plotNpz(
+    fNames, labels=None, ax=None, fs=120e6, *args,
+    nfft=2**15, window="hann", workers=None, **kwargs
+):
+    """
+    plot the averaged spectra of .npz dumps or recordings (.json)
+    from scope_app.py. Spectra are computed in parallel, one process
+    per file, and cached on disk (see psdNpz).
     args, kwargs are passed to plot()
     """
+    # slow imports, only needed for plotting
+    import numpy as np
+    import matplotlib.pyplot as plt
+    from spectrum import Spectrum
     if ax is None:
-        fig, ax = subplots(figsize=(9, 5))
+        fig, ax = plt.subplots(figsize=(9, 5))
     else:
-        fig = gcf()
+        fig = ax.figure
     if labels is None:
         labels = fNames
+    todo = [f for f in fNames if f != "fullscale"]
+    if len(todo) > 1:
+        with ProcessPoolExecutor(workers) as ex:
+            n = len(todo)
+            res = list(ex.map(psdNpz, todo, [fs] * n, [nfft] * n, [window] * n))
+    else:
+        res = [psdNpz(f, fs, nfft, window) for f in todo]
+    res = dict(zip(todo, res))
     for fName, label in zip(fNames, labels):
         if fName == "fullscale":
-            d = sin(arange(4095))
-            dat = vstack([d, d])
+            d = np.sin(np.arange(4095))
+            spec = Spectrum(len(d), fs, nfft, window=window)
+            f, Pxx = spec.f, spec.blockSum(np.vstack([d, d])) / 2
         else:
-            dat = load(fName)["dat"]
-        f, Pxx = periodogram(dat, fs, window='hanning', scaling='spectrum', nfft=2**15)
-        plot(f / 1e6, 10*log10(mean(Pxx, 0)) + 3, label=label, *args, **kwargs)
+            f, Pxx = res[fName]
+        ax.plot(f / 1e6, 10 * np.log10(Pxx.T) + 3, label=label, *args, **kwargs)
     ax.legend()
     ax.set_xlabel("Frequency [MHz]")
     ax.set_ylabel("[db_fs]")
@@ -0,0 +1,163 @@
+"""
+Streaming recorder for raw ADC frames
+
+A recording `<name>` is made of 3 files:
+  <name>.raw   raw frames, appended as they arrive (C order)
+  <name>.ts    float64 unix timestamp of each frame
+  <name>.json  metadata: fs, frame shape, dtype, trigger level, ...
+
+Frames are written in blocks from a background thread with a bounded
+queue, so memory use stays constant no matter how long it runs.
+Use `Recording` to memory-map a recording for reading.
+"""
+import json
+import os
+import queue
+from threading import Thread
+from time import time
+import numpy as np
+from adc_formats import FORMATS
+
+
+class Recorder(Thread):
+    def __init__(
+        self, name, frame_shape, dtype=np.uint16, maxsize=256, chunk=64,
+        **meta
+    ):
+        """
+        name
+            base file name without extension
+        frame_shape
+            shape of one frame, N or (channels, N)
+        meta
+            written to the .json file, like fs=120e6, trig_level=0.1
+        """
+        Thread.__init__(self, daemon=True)
+        if isinstance(frame_shape, int):
+            frame_shape = (frame_shape,)
+        # not self.name, that is the Thread name
+        self.fName = name
+        self.shape = tuple(int(s) for s in frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk = chunk
+        self.q = queue.Queue(maxsize)
+        self.nFrames = 0   # frames written to disk
+        self.nDropped = 0  # frames lost because the queue was full
+        self.meta = dict(meta)
+        self.meta.update({
+            "frame_shape": list(self.shape),
+            "dtype": self.dtype.str,
+            "t_start": time()
+        })
+
+    def put(self, frame, t=None):
+        """ queue a copy of `frame` for writing, never blocks """
+        if t is None:
+            t = time()
+        try:
+            self.q.put_nowait((frame.copy(), t))
+        except queue.Full:
+            self.nDropped += 1
+
+    def writeMeta(self):
+        self.meta["n_frames"] = self.nFrames
+        self.meta["n_dropped"] = self.nDropped
+        with open(self.fName + ".json", "w") as f:
+            json.dump(self.meta, f, indent=2)
+
+    def run(self):
+        block = np.empty((self.chunk,) + self.shape, self.dtype)
+        ts = np.empty(self.chunk)
+        tMeta = time()
+        with open(self.fName + ".raw", "wb") as fRaw, \
+                open(self.fName + ".ts", "wb") as fTs:
+            self.writeMeta()
+            running = True
+            while running:
+                # collect up to `chunk` queued frames into one block write
+                n = 0
+                item = self.q.get()
+                while True:
+                    if item is None:
+                        running = False
+                        break
+                    block[n], ts[n] = item
+                    n += 1
+                    if n >= self.chunk:
+                        break
+                    try:
+                        item = self.q.get_nowait()
+                    except queue.Empty:
+                        break
+                block[:n].tofile(fRaw)
+                ts[:n].tofile(fTs)
+                self.nFrames += n
+                if time() - tMeta > 5:
+                    fRaw.flush()
+                    fTs.flush()
+                    self.writeMeta()
+                    tMeta = time()
+        self.writeMeta()
+
+    def stop(self):
+        """ write all queued frames and close the files """
+        self.q.put(None)
+        self.join()
+
+
+class Recording:
+    """
+    read back a recording lazily
+
+    raw
+        memory-mapped frames, shape (n_frames, *frame_shape)
+    t
+        memory-mapped timestamps, shape (n_frames,)
+    meta
+        dict from the .json file
+    """
+    def __init__(self, name):
+        name, ext = os.path.splitext(name)
+        if ext not in (".json", ".raw", ".ts"):
+            name += ext
+        self.name = name
+        with open(name + ".json") as f:
+            self.meta = json.load(f)
+        shape = tuple(self.meta["frame_shape"])
+        dtype = np.dtype(self.meta["dtype"])
+        # derive the frame count from the file size, the recorder
+        # might not have finished cleanly
+        frameBytes = dtype.itemsize * int(np.prod(shape))
+        n = os.path.getsize(name + ".raw") // frameBytes
+        n = min(n, os.path.getsize(name + ".ts") // 8)
+        if n > 0:
+            self.raw = np.memmap(
+                name + ".raw", dtype, "r", shape=(n,) + shape
+            )
+            self.t = np.memmap(name + ".ts", np.float64, "r", shape=(n,))
+        else:
+            self.raw = np.zeros((0,) + shape, dtype)
+            self.t = np.zeros(0)
+
+    def __len__(self):
+        return len(self.raw)
+
+    def blocks(self, size=256):
+        """ iterate over the frames in blocks of up to `size` """
+        for i in range(0, len(self.raw), size):
+            yield self.raw[i: i + size]
+
+    def toFs(self, raw):
+        """ convert raw frames to full scale float32, see adc_formats.py """
+        return FORMATS[self.meta.get("format", "offset_binary")].toFloat(raw)
+
+    @staticmethod
+    def isRecording(name):
+        base, ext = os.path.splitext(name)
+        if ext not in (".json", ".raw", ".ts"):
+            base = name
+        return os.path.isfile(base + ".json")
+
+    def files(self):
+        """ files holding the content of the recording """
+        return [self.name + ".json", self.name + ".raw"]
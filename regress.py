@@ -0,0 +1,203 @@
+"""
+Run the build / sim steps of all gateware scripts in the repo in parallel
+
+Targets are found by looking for the argv keywords each script checks
+(`'build' in argv`, `"sim1" in argv`, common.main(), ...). Every step
+runs as its own python process in a private copy of the repo under --out,
+so generated files (.v, .vcd, build/) can't collide. At the end a summary
+with wall-clock time and peak memory of each step is printed and written
+to <out>/summary.json.
+
+try:
+ python3 regress.py --list
+ python3 regress.py --steps sim --jobs 4 sp605
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Timer
+from time import perf_counter
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+# these need hardware or a vendor toolchain
+SKIP_STEPS = ("synth", "config", "load", "prog", "build_lib")
+# not copied into the working directories
+COPY_SKIP = (".git", "build", "__pycache__", "measurements")
+SKIP_DIRS = COPY_SKIP + ("xdc",)
+_KEYWORD = re.compile(
+    r"""['"](\w+)['"]\s+(?:not\s+)?in\s+(?:sys\.)?argv|"""
+    r"""argv\[1\]\s*==\s*['"](\w+)['"]"""
+)
+
+
+def scriptSteps(src):
+    """ argv keywords (steps) the script source `src` understands """
+    if "__main__" not in src or not re.search(r"^from migen import", src, re.M):
+        return []
+    steps = set()
+    for m in _KEYWORD.finditer(src):
+        steps.add(m.group(1) or m.group(2))
+    if re.search(r"^from common import .*\bmain\b", src, re.M):
+        # common.main() understands these too. Its sim step needs the
+        # testbench generators passed to main()
+        steps.add("build")
+        if re.search(r"\bmain\([^)]*\bgenerators\s*=", src):
+            steps.add("sim")
+    steps = sorted(s for s in steps if s not in SKIP_STEPS)
+    if not steps and "run_simulation(" in src:
+        steps = [""]  # runs its simulation without arguments
+    return steps
+
+
+def findTargets(root=REPO):
+    """ [(script path relative to root, step), ...] """
+    targets = []
+    for dirPath, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+        for fName in sorted(files):
+            if not fName.endswith(".py") or dirPath == root:
+                continue
+            path = os.path.join(dirPath, fName)
+            with open(path) as f:
+                src = f.read()
+            rel = os.path.relpath(path, root)
+            targets += [(rel, step) for step in scriptSteps(src)]
+    return targets
+
+
+def targetName(script, step):
+    name = script.replace(".py", "").replace(os.sep, "_")
+    return name + ("_" + step if step else "")
+
+
+def _ignore(d, files):
+    return [f for f in files if f in COPY_SKIP or f.endswith(".vcd")]
+
+
+def runTarget(script, step, out, timeout=None):
+    """
+    run one step in a fresh copy of the repo,
+    returns a dict with status, wall-clock seconds and peak memory
+    """
+    name = targetName(script, step)
+    work = os.path.join(out, name)
+    shutil.rmtree(work, ignore_errors=True)
+    shutil.copytree(REPO, work, ignore=_ignore)
+    cwd = os.path.join(work, os.path.dirname(script))
+    cmd = [sys.executable, os.path.basename(script)] + ([step] if step else [])
+    logName = os.path.join(out, name + ".log")
+    res = {"target": name, "script": script, "step": step, "log": logName}
+    with open(logName, "w") as log:
+        t0 = perf_counter()
+        p = subprocess.Popen(
+            cmd, cwd=cwd, stdout=log, stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL
+        )
+        timer = None
+        killed = []
+
+        def kill():
+            killed.append(True)
+            p.kill()
+
+        if timeout is not None:
+            timer = Timer(timeout, kill)
+            timer.start()
+        # wait4 gives the resource usage of just this child
+        _, status, ru = os.wait4(p.pid, 0)
+        res["seconds"] = perf_counter() - t0
+        if timer is not None:
+            timer.cancel()
+    p.returncode = os.waitstatus_to_exitcode(status)
+    res["peak_mb"] = ru.ru_maxrss / 1024  # kB on linux
+    res["returncode"] = p.returncode
+    # the timer may fire just as the step ends, never count that as ok
+    if killed:
+        res["status"] = "timeout"
+    elif p.returncode == 0:
+        res["status"] = "ok"
+    else:
+        res["status"] = "FAIL"
+    return res
+
+
+def printSummary(results, wall):
+    print("\n{:40s} {:>7s} {:>9s} {:>9s}".format(
+        "target", "status", "time [s]", "peak [MB]"
+    ))
+    for r in sorted(results, key=lambda r: -r["seconds"]):
+        print("{:40s} {:>7s} {:9.1f} {:9.1f}".format(
+            r["target"], r["status"], r["seconds"], r["peak_mb"]
+        ))
+    print("{:d} / {:d} ok, wall-clock {:.1f} s, sum of all steps {:.1f} s".format(
+        sum(r["status"] == "ok" for r in results), len(results),
+        wall, sum(r["seconds"] for r in results)
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "filters", nargs="*", help="Only run targets containing one of these strings"
+    )
+    parser.add_argument(
+        "--steps", nargs="+", help="Only run these steps, like build sim"
+    )
+    parser.add_argument(
+        "--jobs", default=os.cpu_count(), type=int, help="Steps running at once"
+    )
+    parser.add_argument(
+        "--timeout", type=float, help="Kill a step after this many seconds"
+    )
+    parser.add_argument(
+        "--out", default="/tmp/regress", help="Working directories and logs"
+    )
+    parser.add_argument(
+        "--list", action="store_true", help="Only list the targets"
+    )
+    args = parser.parse_args()
+
+    targets = findTargets()
+    if args.steps:
+        # a script run without arguments counts as sim
+        targets = [t for t in targets if (t[1] or "sim") in args.steps]
+    if args.filters:
+        targets = [
+            t for t in targets
+            if any(f in targetName(*t) for f in args.filters)
+        ]
+    if args.list:
+        for script, step in targets:
+            print("{:40s} {:s}".format(script, step))
+        return
+
+    os.makedirs(args.out, exist_ok=True)
+    t0 = perf_counter()
+    results = []
+    with ThreadPoolExecutor(args.jobs) as ex:
+        futs = [
+            ex.submit(runTarget, script, step, args.out, args.timeout)
+            for script, step in targets
+        ]
+        for fut in futs:
+            r = fut.result()
+            print("{:7s} {:s} ({:.1f} s)".format(r["status"], r["target"], r["seconds"]))
+            results.append(r)
+    wall = perf_counter() - t0
+    printSummary(results, wall)
+    with open(os.path.join(args.out, "summary.json"), "w") as f:
+        json.dump({"wall_seconds": wall, "results": results}, f, indent=2)
+    if any(r["status"] != "ok" for r in results):
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
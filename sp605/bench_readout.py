@@ -0,0 +1,55 @@
+"""
+benchmark the sample memory readout of hello_LTC.py
+
+reads the `sample` memory with different record lengths N and
+number of read requests in flight (window) and reports frames/s and MB/s
+(4 bytes on the link per 32 bit word).
+
+try:
+ python3 bench_readout.py --N 1024 4096 --window 1 4 16
+"""
+from time import perf_counter
+import argparse
+import sys
+sys.path.append("../")
+from common import conLitexServer, closeLitexServer, readPipelined
+
+
+def bench(r, N, window, reps):
+    """ returns frames/s and MB/s for reading `reps` frames of N words """
+    base = r.mems.sample.base
+    readPipelined(r, base, N, window=window)  # warm up
+    t0 = perf_counter()
+    for i in range(reps):
+        readPipelined(r, base, N, window=window)
+    dt = perf_counter() - t0
+    return reps / dt, reps * N * 4 / dt / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--N", default=[256, 1024, 4096], type=int, nargs="+",
+        help="Number of samples per frame"
+    )
+    parser.add_argument(
+        "--window", default=[1, 2, 4, 8, 16], type=int, nargs="+",
+        help="Number of read requests in flight"
+    )
+    parser.add_argument(
+        "--reps", default=20, type=int, help="Frames to read per data point"
+    )
+    args = parser.parse_args()
+    r = conLitexServer()
+    print("{:>6s} {:>6s} {:>10s} {:>8s}".format(
+        "N", "window", "frames/s", "MB/s"
+    ))
+    for N in args.N:
+        for window in args.window:
+            fps, mbps = bench(r, N, window, args.reps)
+            print("{:6d} {:6d} {:10.1f} {:8.3f}".format(N, window, fps, mbps))
+    closeLitexServer(r)
+
+
+if __name__ == '__main__':
+    main()
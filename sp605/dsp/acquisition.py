@@ -7,21 +7,50 @@ python3 Acquisition.py build
 
 from sys import argv
 from migen import *
-from litex.soc.interconnect.csr import AutoCSR, CSR, CSRStorage
+from litex.soc.interconnect.csr import AutoCSR, CSR, CSRStorage, CSRStatus
+from litex.soc.interconnect import stream
 from migen.genlib.cdc import PulseSynchronizer
-from migen.genlib.cdc import MultiReg
+from migen.genlib.cdc import MultiReg, BusSynchronizer
 
 
 class Acquisition(Module, AutoCSR):
-    def __init__(self, mems=None, data_ins=None, N_CHANNELS=1, N_BITS=16):
+    def __init__(
+        self, mems=None, data_ins=None, N_CHANNELS=1, N_BITS=16, N_BANKS=1,
+        MAX_SEGMENTS=1, STREAM_DEPTH=0
+    ):
         """
         mems
             list of memory objects of length N_CHANNELS
         acquisition starts after
           * rising edge on self.trigger
           * data_in of the selected channel crossing trig_level
+
+        with pretrig = 1, the memories are written as circular buffer after
+        the rising edge on self.trigger. The level crossing stops it
+        post_count samples later. The trigger sample is at trig_addr, the
+        oldest sample at trig_addr + post_count + 1 (modulo depth).
+
+        N_BANKS = 2 splits each memory into 2 banks (ping-pong). Records go
+        to alternating banks, bank_ready tells the host where the newest
+        one is. With continuous = 1 the acquisition re-arms itself after
+        each record, so it keeps capturing while the host reads.
+
+        MAX_SEGMENTS > 1 enables segmented records: with seg_shift = k a
+        record is made of 2**k segments, each captured on its own level
+        crossing after a single arm. The 64 bit sample clock count at each
+        segment trigger goes to the ts_lo / ts_hi memories, at address
+        bank * MAX_SEGMENTS + segment. Not combined with pretrig.
+
+        STREAM_DEPTH > 0 adds self.source, a stream of the samples of all
+        channels (data0, data1, ...) in the sys clock domain, through an
+        async FIFO of that depth. stream_mode = 1 streams the samples
+        written to memory (last marks the end of a record), 2 streams
+        everything. Samples the FIFO can't take are counted in
+        stream_overflows.
         """
         # uint16, on `sample` clock domain
+        if mems:
+            N_CHANNELS = len(mems)
         if data_ins:
             self.data_ins = data_ins
             N_CHANNELS = len(data_ins)
@@ -29,6 +58,8 @@ class Acquisition(Module, AutoCSR):
             self.data_ins = [Signal((N_BITS, True)) for i in range(N_CHANNELS)]
         self.trigger = Signal()
         self.busy = Signal()
+        # so the host knows how many channel memories to read
+        self.n_channels = CSRStatus(8, reset=N_CHANNELS)
 
         ###
 
@@ -76,37 +107,266 @@ class Acquisition(Module, AutoCSR):
         ]
         self.sync.sample += data_trigger_d.eq(data_trigger)
 
+        # memories twice as wide as a sample hold 2 samples per word,
+        # the first one in the LSBs
+        PACK = mems[0].width // N_BITS
+        assert PACK in (1, 2), "memory width must be N_BITS or 2 * N_BITS"
+        self.pack = CSRStatus(8, reset=PACK)
+        # each memory holds N_BANKS records of L samples, one bank is
+        # written while the host reads the other one
+        L = mems[0].depth * PACK // N_BANKS
         mem_we = Signal()
-        mem_addr = Signal(max=mems[0].depth)
+        mem_addr = Signal(max=L)
+        mem_addr_next = Signal.like(mem_addr)
+        self.comb += If(mem_addr >= L - 1,
+            mem_addr_next.eq(0)
+        ).Else(
+            mem_addr_next.eq(mem_addr + 1)
+        )
+
+        # pre-trigger (circular buffer) mode
+        self.pretrig = CSRStorage(1)
+        # samples to write after the trigger sample in pre-trigger mode
+        self.post_count = CSRStorage(len(mem_addr), reset=L // 2)
+        # memory address of the trigger sample in pre-trigger mode
+        # (of the record in bank_ready)
+        self.trig_addr = CSRStatus(len(mem_addr))
+        pretrig = Signal()
+        post_count = Signal.like(self.post_count.storage)
+        self.specials += [
+            MultiReg(self.pretrig.storage, pretrig, "sample"),
+            MultiReg(self.post_count.storage, post_count, "sample")
+        ]
+        # samples written since arming, to not trigger before the
+        # pre-trigger part of the buffer is valid
+        fill = Signal(max=L + 1)
+        post_cnt = Signal.like(post_count)
+        trig_addr = Signal.like(mem_addr)
+
+        # Bank handling. A finished record goes to bank_ready if the host
+        # has released the previous one, otherwise it is counted as missed
+        # and its bank is overwritten by the next record.
+        self.n_banks = CSRStatus(8, reset=N_BANKS)
+        # re-arm right after each record instead of waiting for trig_csr
+        self.continuous = CSRStorage(1)
+        # bank of the newest finished record
+        self.bank_ready = CSRStatus(8)
+        # 1 when bank_ready holds a record the host has not released yet
+        self.ready_valid = CSRStatus(1)
+        # writing release hands bank_ready back to the acquisition
+        self.release = CSR()
+        # number of finished records, of those, number not delivered
+        self.records = CSRStatus(32)
+        self.missed = CSRStatus(32)
+        continuous = Signal()
+        bank_wr = Signal(max=max(N_BANKS, 2))
+        bank_ready = Signal.like(bank_wr)
+        ready_valid = Signal()
+        ready_trig_addr = Signal.like(trig_addr)
+        records = Signal(32)
+        missed = Signal(32)
+        done = Signal()  # last sample of a record is written
+        self.submodules.release_sync = PulseSynchronizer("sys", "sample")
+        self.comb += self.release_sync.i.eq(self.release.re)
+        self.specials += [
+            MultiReg(self.continuous.storage, continuous, "sample"),
+            MultiReg(bank_ready, self.bank_ready.status),
+            MultiReg(ready_valid, self.ready_valid.status),
+            MultiReg(ready_trig_addr, self.trig_addr.status)
+        ]
+        # multi bit counters, a MultiReg could tear while they change
+        for name, cnt, csr in [
+            ("records", records, self.records),
+            ("missed", missed, self.missed)
+        ]:
+            bs = BusSynchronizer(32, "sample", "sys")
+            setattr(self.submodules, name + "_sync", bs)
+            self.comb += [bs.i.eq(cnt), csr.status.eq(bs.o)]
+        self.sync.sample += [
+            If(self.release_sync.o,
+                ready_valid.eq(0)
+            ),
+            If(done,
+                records.eq(records + 1),
+                If(~ready_valid if N_BANKS > 1 else 1,
+                    bank_ready.eq(bank_wr),
+                    ready_trig_addr.eq(trig_addr),
+                    ready_valid.eq(1),
+                    If(bank_wr >= N_BANKS - 1,
+                        bank_wr.eq(0)
+                    ).Else(
+                        bank_wr.eq(bank_wr + 1)
+                    )
+                ).Else(
+                    missed.eq(missed + 1)
+                )
+            )
+        ]
+
+        # Segments and timestamps
+        ts = Signal(64)  # free running sample clock counter
+        self.sync.sample += ts.eq(ts + 1)
+        seg = Signal(max=max(MAX_SEGMENTS, 2))
+        ts_we = Signal()
+        # high on the last sample of a segment
+        seg_last = Signal()
+        if MAX_SEGMENTS > 1:
+            log2_int(L)  # segments need a power of 2 record length
+            self.seg_shift = CSRStorage(bits_for(log2_int(MAX_SEGMENTS)))
+            self.max_segments = CSRStatus(bits_for(MAX_SEGMENTS), reset=MAX_SEGMENTS)
+            seg_shift = Signal.like(self.seg_shift.storage)
+            seg_mask = Signal.like(mem_addr)
+            self.specials += MultiReg(self.seg_shift.storage, seg_shift, "sample")
+            self.comb += [
+                seg_mask.eq((L - 1) >> seg_shift),
+                seg_last.eq((mem_addr & seg_mask) == seg_mask)
+            ]
+            self.ts_lo = Memory(32, N_BANKS * MAX_SEGMENTS)
+            self.ts_hi = Memory(32, N_BANKS * MAX_SEGMENTS)
+            for m, v in ((self.ts_lo, ts[:32]), (self.ts_hi, ts[32:])):
+                p = m.get_port(write_capable=True, clock_domain="sample")
+                self.specials += m, p
+                self.comb += [
+                    p.adr.eq(bank_wr * MAX_SEGMENTS + seg),
+                    p.dat_w.eq(v),
+                    p.we.eq(ts_we)
+                ]
+        else:
+            self.comb += seg_last.eq(mem_addr >= L - 1)
+
         self.submodules.fsm = ClockDomainsRenamer("sample")(FSM())
         self.fsm.act("WAIT_TRIGGER",
-            If(trig, NextState("WAIT_LEVEL"))
+            If(trig, NextState("ARM"))
+        )
+        self.fsm.act("ARM",
+            NextValue(mem_addr, 0),
+            NextValue(seg, 0),
+            NextValue(fill, 0),
+            If(pretrig,
+                NextState("RING")
+            ).Else(
+                NextState("WAIT_LEVEL")
+            )
+        )
+        # after a record: next one right away or wait for trig_csr
+        next_state = Signal()
+        self.fsm.act("RING",
+            mem_we.eq(1),
+            NextValue(mem_addr, mem_addr_next),
+            If(fill < L,
+                NextValue(fill, fill + 1)
+            ),
+            If(is_trigger & (fill + post_count >= L - 1),
+                NextValue(trig_addr, mem_addr),
+                NextValue(post_cnt, post_count),
+                If(post_count == 0,
+                    done.eq(1),
+                    next_state.eq(1)
+                ).Else(
+                    NextState("POST")
+                )
+            )
+        )
+        self.fsm.act("POST",
+            mem_we.eq(1),
+            NextValue(mem_addr, mem_addr_next),
+            NextValue(post_cnt, post_cnt - 1),
+            If(post_cnt <= 1,
+                done.eq(1),
+                next_state.eq(1)
+            )
         )
         self.fsm.act("WAIT_LEVEL",
             If(is_trigger,
                 mem_we.eq(1),
+                ts_we.eq(1),
+                NextValue(seg, seg + 1),
                 NextValue(mem_addr, mem_addr + 1),
+                NextValue(trig_addr, 0),
                 NextState("ACQUIRE")
             )
         )
         self.fsm.act("ACQUIRE",
             mem_we.eq(1),
             NextValue(mem_addr, mem_addr + 1),
-            If(mem_addr >= mems[0].depth - 1,
-                NextState("WAIT_TRIGGER"),
-                NextValue(mem_addr, 0)
+            If(mem_addr >= L - 1,
+                done.eq(1),
+                next_state.eq(1)
+            ).Elif(seg_last,
+                # wait for the trigger of the next segment
+                NextState("WAIT_LEVEL")
             )
         )
+        for state in ("RING", "POST", "ACQUIRE"):
+            self.fsm.act(state,
+                If(next_state,
+                    If(continuous,
+                        NextState("ARM")
+                    ).Else(
+                        NextState("WAIT_TRIGGER")
+                    )
+                )
+            )
         self.comb += self.busy.eq(~self.fsm.ongoing('WAIT_TRIGGER'))
+        sample_addr = Signal(max=N_BANKS * L)
+        self.comb += sample_addr.eq(bank_wr * L + mem_addr)
         for mem, data_in in zip(mems, self.data_ins):
             self.specials += mem
-            p1 = mem.get_port(write_capable=True, clock_domain="sample")
+            if PACK == 1:
+                p1 = mem.get_port(write_capable=True, clock_domain="sample")
+                self.comb += [
+                    p1.dat_w.eq(data_in),
+                    p1.adr.eq(sample_addr),
+                    p1.we.eq(mem_we)
+                ]
+            else:
+                # write one half of the word, selected by the address LSB
+                p1 = mem.get_port(
+                    write_capable=True, we_granularity=N_BITS,
+                    clock_domain="sample"
+                )
+                self.comb += [
+                    p1.dat_w.eq(Cat(data_in, data_in)),
+                    p1.adr.eq(sample_addr[1:]),
+                    p1.we.eq(Cat(
+                        mem_we & ~sample_addr[0], mem_we & sample_addr[0]
+                    ))
+                ]
             self.specials += p1
+
+        if STREAM_DEPTH > 0:
+            layout = [("data{:d}".format(i), N_BITS) for i in range(N_CHANNELS)]
+            self.source = stream.Endpoint(layout)
+            self.stream_mode = CSRStorage(2)
+            self.stream_overflows = CSRStatus(32)
+            stream_mode = Signal(2)
+            overflows = Signal(32)
+            fifo = ClockDomainsRenamer({"write": "sample", "read": "sys"})(
+                stream.AsyncFIFO(layout, STREAM_DEPTH)
+            )
+            self.submodules.stream_fifo = fifo
+            self.specials += MultiReg(
+                self.stream_mode.storage, stream_mode, "sample"
+            )
+            self.submodules.overflows_sync = BusSynchronizer(
+                32, "sample", "sys"
+            )
+            self.comb += [
+                self.overflows_sync.i.eq(overflows),
+                self.stream_overflows.status.eq(self.overflows_sync.o)
+            ]
             self.comb += [
-                p1.dat_w.eq(data_in),
-                p1.adr.eq(mem_addr),
-                p1.we.eq(mem_we)
+                fifo.sink.valid.eq(
+                    ((stream_mode == 1) & mem_we) | (stream_mode == 2)
+                ),
+                fifo.sink.last.eq(done),
+                fifo.source.connect(self.source)
             ]
+            for i, data_in in enumerate(self.data_ins):
+                self.comb += getattr(fifo.sink, "data{:d}".format(i)).eq(data_in)
+            self.sync.sample += If(fifo.sink.valid & ~fifo.sink.ready,
+                overflows.eq(overflows + 1)
+            )
 
 
 def sample_generator(dut):
@@ -117,6 +377,25 @@ def sample_generator(dut):
         if i == 15 or i == 75:
             yield dut.trigger.eq(1)
         yield
+    # pre-trigger mode, trigger level crossing at 130
+    yield dut.pretrig.storage.eq(1)
+    yield dut.post_count.storage.eq(3)
+    yield dut.trig_level.storage.eq(130)
+    for i in range(101, 161):
+        yield dut.trigger.eq(i == 110)
+        yield dut.data_ins[0].eq(i)
+        yield
+
+
+def stream_generator(dut):
+    """ continuous streaming, reads only every 2nd cycle """
+    yield dut.stream_mode.storage.eq(2)
+    for i in range(100):
+        yield dut.source.ready.eq(i % 2)
+        if (yield dut.source.valid) and (yield dut.source.ready):
+            print("stream:", (yield dut.source.data0))
+        yield
+    print("overflows:", (yield dut.stream_overflows.status))
 
 
 def main():
@@ -140,6 +419,17 @@ def main():
             {"sys": 10, "sample": 9},
             vcd_name=argv[0].replace(".py", ".vcd")
         )
+    if "sim_stream" in argv:
+        dut = Acquisition(STREAM_DEPTH=8)
+        run_simulation(
+            dut,
+            {
+                "sample": sample_generator(dut),
+                "sys": stream_generator(dut)
+            },
+            {"sys": 10, "sample": 9},
+            vcd_name=argv[0].replace(".py", "_stream.vcd")
+        )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,171 @@
+"""
+Coherent averaging of triggered records in block RAM
+
+Sums n_avg records from a sample stream (Acquisition.source with
+stream_mode = 1) into one ACC_BITS wide accumulator per sample and
+channel. The host reads the sums over wishbone once busy drops and
+divides by n_done, instead of reading every record.
+
+try
+python3 averager.py <build / sim>
+"""
+from sys import argv
+from migen import *
+from litex.soc.interconnect.csr import AutoCSR, CSR, CSRStorage, CSRStatus
+from litex.soc.interconnect import stream, wishbone
+
+
+class Averager(Module, AutoCSR):
+    def __init__(self, N_CHANNELS=1, L=4096, N_BITS=16, ACC_BITS=32):
+        """
+        L
+            record length (power of 2). A record ends after L samples or
+            on sink.last, whichever comes first
+        ACC_BITS
+            accumulator width, n_avg must stay below 2**(ACC_BITS - N_BITS)
+            samples are summed as unsigned (offset binary) numbers
+        """
+        self.sink = stream.Endpoint(
+            [("data{:d}".format(i), N_BITS) for i in range(N_CHANNELS)]
+        )
+        # accumulator of channel i at word offset i * L
+        self.bus = wishbone.Interface()
+        # number of records to sum
+        self.n_avg = CSRStorage(32, reset=16)
+        # writing start clears the accumulators with the next record
+        self.start = CSR()
+        self.busy = CSRStatus()
+        # records summed so far
+        self.n_done = CSRStatus(32)
+        self.length = CSRStatus(32, reset=L)
+
+        ###
+
+        A = log2_int(L)
+        idx = Signal(A)
+        running = Signal()
+        take = Signal()
+        n = self.n_done.status
+        self.comb += [
+            # never back-pressure the ADC
+            self.sink.ready.eq(1),
+            take.eq(self.sink.valid & running),
+            self.busy.status.eq(running)
+        ]
+        self.sync += [
+            If(self.start.re,
+                running.eq(self.n_avg.storage != 0),
+                idx.eq(0),
+                n.eq(0)
+            ).Elif(take,
+                idx.eq(idx + 1),
+                If(self.sink.last | (idx == L - 1),
+                    idx.eq(0),
+                    n.eq(n + 1),
+                    If(n + 1 >= self.n_avg.storage,
+                        running.eq(0)
+                    )
+                )
+            )
+        ]
+
+        # 2 stage pipeline: read the accumulator, then write back the sum
+        take_d = Signal()
+        idx_d = Signal(A)
+        first_d = Signal()  # overwrite during the first record
+        self.sync += [
+            take_d.eq(take),
+            idx_d.eq(idx),
+            first_d.eq(n == 0)
+        ]
+        rd_datas = []
+        for i in range(N_CHANNELS):
+            mem = Memory(ACC_BITS, L)
+            rd = mem.get_port()
+            wr = mem.get_port(write_capable=True)
+            self.specials += mem, rd, wr
+            x_d = Signal(N_BITS)
+            self.sync += x_d.eq(getattr(self.sink, "data{:d}".format(i)))
+            self.comb += [
+                # the host gets the read port when not running
+                rd.adr.eq(Mux(running, idx, self.bus.adr[:A])),
+                wr.adr.eq(idx_d),
+                wr.we.eq(take_d),
+                wr.dat_w.eq(Mux(first_d, x_d, rd.dat_r + x_d))
+            ]
+            rd_datas.append(rd.dat_r)
+
+        # read-only wishbone slave, like wishbone.SRAM
+        sel = Signal(max=max(N_CHANNELS, 2))
+        self.sync += [
+            self.bus.ack.eq(0),
+            If(self.bus.cyc & self.bus.stb & ~self.bus.ack,
+                self.bus.ack.eq(1)
+            ),
+            sel.eq(self.bus.adr[A:A + bits_for(N_CHANNELS - 1)])
+        ]
+        self.comb += self.bus.dat_r.eq(Array(rd_datas)[sel])
+
+
+def sample_generator(dut, L, n_avg):
+    """ n_avg records of a ramp, with gaps """
+    yield dut.n_avg.storage.eq(n_avg)
+    yield dut.start.re.eq(1)
+    yield
+    yield dut.start.re.eq(0)
+    for k in range(n_avg):
+        for i in range(L):
+            yield dut.sink.valid.eq(1)
+            yield dut.sink.data0.eq(i)
+            yield dut.sink.last.eq(i == L - 1)
+            yield
+            yield dut.sink.valid.eq(0)
+            yield
+    yield dut.sink.valid.eq(0)
+    for i in range(4):
+        yield
+    print("n_done:", (yield dut.n_done.status))
+    res = []
+    for i in range(L):
+        yield dut.bus.adr.eq(i)
+        yield dut.bus.cyc.eq(1)
+        yield dut.bus.stb.eq(1)
+        yield
+        while not (yield dut.bus.ack):
+            yield
+        res.append((yield dut.bus.dat_r))
+        yield dut.bus.cyc.eq(0)
+        yield dut.bus.stb.eq(0)
+        yield
+    print("sums:", res)
+    assert res == [i * n_avg for i in range(L)], res
+
+
+def main():
+    L = 16
+    dut = Averager(L=L)
+    if "build" in argv:
+        ''' generate a .v file for simulation with Icarus / general usage '''
+        from migen.fhdl.verilog import convert
+        convert(
+            dut,
+            ios={
+                dut.sink.valid, dut.sink.last, dut.sink.data0,
+                dut.bus.adr, dut.bus.dat_r, dut.bus.cyc, dut.bus.stb,
+                dut.bus.ack
+            },
+            display_run=True
+        ).write(argv[0].replace(".py", ".v"))
+    if "sim" in argv:
+        run_simulation(
+            dut,
+            sample_generator(dut, L, 4),
+            vcd_name=argv[0].replace(".py", ".vcd")
+        )
+
+
+if __name__ == '__main__':
+    if len(argv) <= 1:
+        print(__doc__)
+        exit(-1)
+    main()
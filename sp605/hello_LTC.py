@@ -16,6 +16,7 @@ from migen.genlib.cdc import MultiReg
 from litex.boards.platforms import sp605
 from litex.build.generic_platform import *
 from litex.soc.interconnect.csr import *
+from litex.soc.interconnect import wishbone
 from litex.soc.interconnect.wishbone import SRAM
 from liteeth.phy import LiteEthPHY
 from liteeth.core import LiteEthUDPIPCore
@@ -29,9 +30,11 @@ from litex.soc.cores.clock import S6PLL
 from sys import argv, exit, path
 from shutil import copyfile
 from dsp.acquisition import Acquisition
+from dsp.averager import Averager
+from spi_seq import SpiSequencer
 path.append("..")
 path.append("iserdes")
-from common import main, ltc_pads
+from common import main, ltc_pads, CSR_HASH_TAG, stampCsrHash
 from ltc_phy import LTCPhy
 
 
@@ -87,8 +90,13 @@ class HelloLtc(SoCCore, AutoCSR):
     csr_peripherals = [
         "dna",
         "spi",
+        "spi_seq",
+        "spi_seq_table",
         "lvds",
-        "acq"
+        "acq",
+        "acq_ts_lo",
+        "acq_ts_hi",
+        "avg"
     ]
     csr_map_update(SoCCore.csr_map, csr_peripherals)
 
@@ -104,7 +112,7 @@ class HelloLtc(SoCCore, AutoCSR):
             integrated_rom_size=0,
             integrated_main_ram_size=0,
             integrated_sram_size=0,
-            ident="LTC2175 demonstrator", ident_version=True,
+            ident="LTC2175 demonstrator" + CSR_HASH_TAG, ident_version=True,
             **kwargs
         )
         p = self.platform
@@ -134,23 +142,63 @@ class HelloLtc(SoCCore, AutoCSR):
         #  SPI master
         # ----------------------------
         spi_pads = p.request("LTC_SPI")
-        self.submodules.spi = spi.SPIMaster(spi_pads)
+        # programs the LTC2175 from a register table right after reset,
+        # the SPIMaster gets the pads when the sequencer is idle
+        self.submodules.spi_seq = SpiSequencer(spi_pads, clk_freq)
+        self.submodules.spi = spi.SPIMaster(self.spi_seq.pads_master)
+        self.spi_seq.connect_master(self.spi)
 
         # ----------------------------
         #  Acquisition memory for ADC data
         # ----------------------------
-        mem = Memory(16, 4096)
-        self.specials += mem
-        self.submodules.sample_ram = SRAM(mem, read_only=True)
-        self.register_mem("sample", 0x50000000, self.sample_ram.bus, 4096)
-        self.submodules.acq = Acquisition([mem])
+        # one memory per ADC channel, all triggered together.
+        # Channel i is at word offset i * DEPTH of the `sample` region,
+        # so all channels can be read back in one go.
+        # Each 32 bit word holds 2 samples, the first one in the LSBs.
+        # Each memory holds 2 banks of DEPTH samples (ping-pong),
+        # a bank can be split into up to 64 segments
+        N_CH = len(self.lvds.sample_outs)
+        DEPTH = 4096
+        A = log2_int(DEPTH)
+        mems = [Memory(32, DEPTH) for i in range(N_CH)]
+        sample_bus = wishbone.Interface()
+        slaves = []
+        for i, mem in enumerate(mems):
+            sram = SRAM(mem, read_only=True)
+            setattr(self.submodules, "sample_ram{:d}".format(i), sram)
+            slaves.append((lambda a, i=i: a[A:A + bits_for(N_CH - 1)] == i, sram.bus))
+        self.submodules.sample_dec = wishbone.Decoder(sample_bus, slaves, register=True)
+        self.register_mem("sample", 0x50000000, sample_bus, N_CH * DEPTH * 4)
+        self.submodules.acq = Acquisition(
+            mems, N_BANKS=2, MAX_SEGMENTS=64, STREAM_DEPTH=16
+        )
         self.specials += MultiReg(
             p.request("user_btn"), self.acq.trigger
         )
+        self.comb += p.request("user_led").eq(self.acq.busy)
+        for data_in, sample_out in zip(self.acq.data_ins, self.lvds.sample_outs):
+            self.comb += data_in.eq(sample_out)
+
+        # ----------------------------
+        #  Coherent averaging of acquired records
+        # ----------------------------
+        # consumers of acq.source never back-pressure it
+        self.comb += self.acq.source.ready.eq(1)
+        self.submodules.avg = Averager(N_CH, DEPTH)
         self.comb += [
-            p.request("user_led").eq(self.acq.busy),
-            self.acq.data_ins[0].eq(self.lvds.sample_out),
+            self.avg.sink.valid.eq(self.acq.source.valid),
+            self.avg.sink.last.eq(self.acq.source.last)
         ]
+        for i in range(N_CH):
+            name = "data{:d}".format(i)
+            self.comb += getattr(self.avg.sink, name).eq(
+                getattr(self.acq.source, name)
+            )
+        self.register_mem("avg", 0x30000000, self.avg.bus, N_CH * DEPTH * 4)
+
+    def do_finalize(self):
+        SoCCore.do_finalize(self)
+        stampCsrHash(self)
 
 
 # Add etherbone support
@@ -13,30 +13,47 @@ class LTCPhy(Sp6PLL, AutoCSR):
     """
     wire things up to CSRs
     this is done here to keep sp6_* more or less simulate-able
+
+    channels
+        which LTC_OUT pads (ADC channels) to receive, 2 LVDS lanes each.
+        sample_outs has one 16 bit output per channel, in the same order.
+        LTC_OUT 0 and 1 are in bank 0, on the other device edge than
+        LTC_FR (bank 2). Their lanes are clocked by a second PLL / BUFPLL
+        (Sp6PLL TOP_LANES).
     """
-    def __init__(self, platform, f_enc):
+    TOP_CHANNELS = (0, 1)
+
+    def __init__(self, platform, f_enc, channels=(0, 1, 2, 3)):
         S = 8
         M = 8  # 8 DCO ticks during one frame tick
-        D = 2
+        D = 2 * len(channels)
+        TOP_LANES = [
+            2 * i + k for i, ch in enumerate(channels)
+            if ch in self.TOP_CHANNELS for k in range(2)
+        ]
         DCO_PERIOD = 1 / (f_enc) * 1e9
         print("f_enc:", f_enc, "DCO_PERIOD:", DCO_PERIOD)
         # Note: LTC2175 streams the MSB first and needs bit-mirroring
         Sp6PLL.__init__(
             self, S=S, D=D, M=M, MIRROR_BITS=True,
             DCO_PERIOD=DCO_PERIOD, CLK_EDGE_ALIGNED=True,
-            BITSLIPS=2
+            BITSLIPS=2, TOP_LANES=TOP_LANES
         )
 
         # pads_dco = platform.request("LTC_DCO")
         pads_frm = platform.request("LTC_FR")
-        pads_chx = platform.request("LTC_OUT", 2)
+        pads_chs = [platform.request("LTC_OUT", ch) for ch in channels]
 
         # CSRs for peeking at clock / data patterns
-        self.sample_out = Signal(16)
-        # LVDS_B (data_outs[1]) has the LSB and needs to come first!
-        self.comb += self.sample_out.eq(
-            Cat(myzip(self.data_outs[1], self.data_outs[0]))
-        )
+        # LVDS_B (odd lane) has the LSB and needs to come first!
+        self.sample_outs = []
+        for i in range(len(channels)):
+            sample_out = Signal(16)
+            self.comb += sample_out.eq(
+                Cat(myzip(self.data_outs[2 * i + 1], self.data_outs[2 * i]))
+            )
+            self.sample_outs.append(sample_out)
+        self.sample_out = self.sample_outs[0]
         self.data_peek = CSRStatus(16)
         self.specials += MultiReg(
             self.sample_out,
@@ -49,11 +66,28 @@ class LTCPhy(Sp6PLL, AutoCSR):
         self.bitslip_csr = CSR(1)
         self.submodules.bs_sync = PulseSynchronizer("sys", "sample")
 
-        # CSR to read phase detectors
-        for i, phase_sample in enumerate(self.pd_int_phases):
+        # CSRs to read phase detectors and IDELAY positions.
+        # All of them are latched together at the end of each integration
+        # period and pd_seq counts the periods. A host reading pd_seq before
+        # and after the others can tell if they belong to the same period.
+        self.submodules.pd_sync = PulseSynchronizer("sample", "sys")
+        self.comb += self.pd_sync.i.eq(self.pd_strobe)
+        self.pd_seq = CSRStatus(32)
+        self.sync += If(self.pd_sync.o,
+            self.pd_seq.status.eq(self.pd_seq.status + 1)
+        )
+        for i, (phase_sample, tap) in enumerate(
+            zip(self.pd_int_phases, self.pd_id_taps)
+        ):
             pd_phase_x = CSRStatus(32, name="pd_phase_{:d}".format(i))
-            self.specials += MultiReg(phase_sample, pd_phase_x.status)
+            id_tap_x = CSRStatus(8, name="id_tap_{:d}".format(i))
+            # stable for a whole integration period, no need for MultiReg
+            self.sync += If(self.pd_sync.o,
+                pd_phase_x.status.eq(phase_sample),
+                id_tap_x.status.eq(tap)
+            )
             setattr(self, "pd_phase_{:d}".format(i), pd_phase_x)
+            setattr(self, "id_tap_{:d}".format(i), id_tap_x)
 
         # CSR for setting PD integration cycles
         self.pd_period_csr = CSRStorage(32, reset=2**20)
@@ -90,8 +124,8 @@ class LTCPhy(Sp6PLL, AutoCSR):
             # (mis)using FRAME as /8 clock works fine and gives us a bitslip test-pattern
             self.dco_p.eq(pads_frm.p),
             self.dco_n.eq(pads_frm.n),
-            self.lvds_data_p.eq(Cat(pads_chx.a_p, pads_chx.b_p)),
-            self.lvds_data_n.eq(Cat(pads_chx.a_n, pads_chx.b_n)),
+            self.lvds_data_p.eq(Cat([Cat(p.a_p, p.b_p) for p in pads_chs])),
+            self.lvds_data_n.eq(Cat([Cat(p.a_n, p.b_n) for p in pads_chs])),
             self.bs_sync.i.eq(self.bitslip_csr.re),
             self.bitslip.eq(self.bs_sync.o),
             self.reset.eq(ResetSignal("sys")),
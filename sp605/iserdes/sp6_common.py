@@ -8,13 +8,16 @@ from migen.genlib.misc import WaitTimer, timeline
 class Sp6Common(Module):
     def __init__(
         self, S, D, MIRROR_BITS, BITSLIPS,
-        idelay_overrides={}, iserdes_overrides={}
+        idelay_overrides={}, iserdes_overrides={}, TOP_LANES=()
     ):
         """
         Generates all logic necessary for the data lanes, calibration
         and phase detection / adjustment
         Does not do anything related to clocking.
         Inherit and add you own clock.
+
+        TOP_LANES = lanes on the other device edge than the clock lane,
+            clocked by ioclk_top / serdesstrobe_top (a second BUFPLL)
         """
         # LVDS DDR bit clock
         self.dco_p = Signal()
@@ -32,6 +35,10 @@ class Sp6Common(Module):
         self.pd_int_period = Signal(32, reset=2**23)
         # outputs integrated Phase detector values (int32)
         self.pd_int_phases = [Signal((32, True)) for i in range(D)]
+        # IDELAY positions relative to calibration, latched with pd_int_phases
+        self.pd_id_taps = [Signal((8, True)) for i in range(D)]
+        # pulses when pd_int_phases and pd_id_taps have been updated
+        self.pd_strobe = Signal()
         # input to enable auto increment / decrement IDELAY based on PD value
         self.id_auto_control = Signal()
 
@@ -53,6 +60,9 @@ class Sp6Common(Module):
         self.ioclk_p = Signal()
         self.ioclk_n = Signal()
         self.serdesstrobe = Signal()
+        # only used by TOP_LANES
+        self.ioclk_top = Signal()
+        self.serdesstrobe_top = Signal()
 
         # -----------------------------
         #  IDELAY calibration
@@ -98,7 +108,8 @@ class Sp6Common(Module):
                 pd_int_cnt.eq(0),
             ).Elif(self.initial_tl_done,     # only start counting when idelays are calibrated
                 pd_int_cnt.eq(pd_int_cnt + 1)
-            )
+            ),
+            self.pd_strobe.eq(pd_int_cnt >= self.pd_int_period)
         ]
 
         # -----------------------------
@@ -135,11 +146,22 @@ class Sp6Common(Module):
         self.iserdes_default.update(iserdes_overrides)
 
         for i in range(D):
+            idelay_kw = self.idelay_default
+            iserdes_kw = self.iserdes_default
+            if i in TOP_LANES:
+                idelay_kw = dict(
+                    idelay_kw, i_IOCLK0=self.ioclk_top, i_IOCLK1=0
+                )
+                iserdes_kw = dict(
+                    iserdes_kw, i_CLK0=self.ioclk_top, i_CLK1=0,
+                    i_IOCE=self.serdesstrobe_top
+                )
             lvds_data = Signal()
             lvds_data_m = Signal()
             lvds_data_s = Signal()
             id_CE = Signal()
             id_INC = Signal()
+            id_tap = Signal.like(self.pd_id_taps[i])
             # -------------------------------------
             #  Idelay control (auto / manual)
             # -------------------------------------
@@ -159,6 +181,16 @@ class Sp6Common(Module):
                 ).Else(
                     id_CE.eq((self.id_mux == i) & (self.id_inc ^ self.id_dec)),
                     id_INC.eq(self.id_inc)
+                ),
+                # Keep track of the IDELAY position
+                If(self.idelay_rst,
+                    id_tap.eq(0)
+                ).Elif(id_CE,
+                    If(id_INC,
+                        id_tap.eq(id_tap + 1)
+                    ).Else(
+                        id_tap.eq(id_tap - 1)
+                    )
                 )
             ]
             self.specials += DifferentialInput(
@@ -173,7 +205,7 @@ class Sp6Common(Module):
                 i_CE=id_CE,
                 i_INC=id_INC,
                 o_DATAOUT=lvds_data_m,
-                **self.idelay_default
+                **idelay_kw
             )
             self.specials += Instance(
                 "IODELAY2",
@@ -184,7 +216,7 @@ class Sp6Common(Module):
                 i_CE=id_CE,
                 i_INC=id_INC,
                 o_DATAOUT=lvds_data_s,
-                **self.idelay_default
+                **idelay_kw
             )
             cascade_up = Signal()
             cascade_down = Signal()
@@ -205,13 +237,14 @@ class Sp6Common(Module):
                 # The phase detector outputs
                 o_VALID=pdValid,
                 o_INCDEC=pdInc,
-                **self.iserdes_default
+                **iserdes_kw
             )
             # Accumulate increment / decrement pulses
             self.sync.sample += [
                 If(pd_int_cnt >= self.pd_int_period,
                     # Latch accumulator value into output registers
                     self.pd_int_phases[i].eq(pdAcc),
+                    self.pd_id_taps[i].eq(id_tap),
                     # Reset accumulators
                     pdAcc.eq(0)
                 ).Elif(pdValid & self.initial_tl_done,
@@ -233,7 +266,7 @@ class Sp6Common(Module):
                 o_Q2=tempData[1],
                 o_Q1=tempData[0],
                 o_SHIFTOUT=cascade_up,
-                **self.iserdes_default
+                **iserdes_kw
             )
             if MIRROR_BITS:
                 self.comb += self.data_outs[i].eq(tempData[::-1])
@@ -255,6 +288,8 @@ class Sp6Common(Module):
             self.id_inc,
             self.id_dec,
             self.reset,
+            self.pd_strobe,
             *self.pd_int_phases,
+            *self.pd_id_taps,
             *self.data_outs
         }
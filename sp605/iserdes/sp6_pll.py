@@ -33,7 +33,7 @@ from sp6_common import Sp6Common
 class Sp6PLL(Sp6Common):
     def __init__(
         self, S=8, D=2, M=2, MIRROR_BITS=False, CLK_EDGE_ALIGNED=True,
-        BITSLIPS=0, DCO_PERIOD=2.0, **kwargs
+        BITSLIPS=0, DCO_PERIOD=2.0, TOP_LANES=(), **kwargs
     ):
         """
         Clock and data lanes must be in-phase (edge aligned)
@@ -53,6 +53,11 @@ class Sp6PLL(Sp6Common):
             first bit of the serial stream clocked in ends up in the
             LSB of data_outs
 
+        TOP_LANES = data lanes on the other device edge than the clock lane.
+            A BUFPLL can only be driven by a PLL on its own edge, these
+            lanes get a second PLL_ADV and BUFPLL, fed from the `sample`
+            BUFG.
+
         See Sp6Common.py for input output ports
         """
         # Data recovered from the clock lane for frame alignment (in case of a divided clock)
@@ -60,6 +65,8 @@ class Sp6PLL(Sp6Common):
 
         # High when sample clock is stable
         self.pll_locked = Signal()
+        # High when the TOP_LANES ioclk is stable
+        self.pll_top_locked = Signal(reset=1)
 
         ###
 
@@ -67,11 +74,14 @@ class Sp6PLL(Sp6Common):
         Sp6Common.__init__(
             self, S, D, MIRROR_BITS, BITSLIPS,
             {"p_DATA_RATE": "SDR"},
-            {"p_DATA_RATE": "SDR"}
+            {"p_DATA_RATE": "SDR"},
+            TOP_LANES
         )
 
         # Sync resets
-        self.specials += AsyncResetSynchronizer(self.sample, ~self.pll_locked)
+        self.specials += AsyncResetSynchronizer(
+            self.sample, ~(self.pll_locked & self.pll_top_locked)
+        )
 
         # -------------------------------------
         #  Iserdes PLL clocking scheme
@@ -208,6 +218,54 @@ class Sp6PLL(Sp6Common):
         # ioclk_n is not needed, hardwire it to zero
         self.comb += self.ioclk_n.eq(0)
 
+        if TOP_LANES:
+            # same bit clock for the other edge, phase aligned to `sample`
+            # by the PLL feedback. The IDELAY phase detectors of these
+            # lanes take care of the remaining skew.
+            pll_top_clk0 = Signal()
+            pll_top_fb = Signal()
+            self.specials += Instance(
+                "PLL_ADV",
+                name="PLL_IOCLOCK_TOP",
+                p_BANDWIDTH="OPTIMIZED",
+                p_SIM_DEVICE="SPARTAN6",
+                p_CLKIN1_PERIOD=DCO_PERIOD * S / M,
+                p_CLKIN2_PERIOD=DCO_PERIOD * S / M,
+                p_DIVCLK_DIVIDE=1,
+                p_CLKFBOUT_MULT=S,
+                p_CLKFBOUT_PHASE=0.0,
+                p_CLKOUT0_DIVIDE=1,
+                p_CLKOUT0_DUTY_CYCLE=0.5,
+                p_CLKOUT0_PHASE=0.0,
+                p_COMPENSATION="INTERNAL",
+                p_CLK_FEEDBACK="CLKFBOUT",
+
+                i_RST=self.reset | ~self.pll_locked,
+                i_CLKINSEL=1,
+                i_CLKIN1=ClockSignal("sample"),
+                i_CLKIN2=0,
+                o_CLKFBOUT=pll_top_fb,
+                i_CLKFBIN=pll_top_fb,
+
+                i_DADDR=Signal(5),
+                i_DI=Signal(16),
+                i_DEN=0,
+                i_DWE=0,
+                i_DCLK=0,
+
+                o_CLKOUT0=pll_top_clk0,
+                o_LOCKED=self.pll_top_locked
+            )
+            self.specials += Instance(
+                "BUFPLL",
+                p_DIVIDE=S,
+                i_PLLIN=pll_top_clk0,
+                i_GCLK=ClockSignal("sample"),
+                i_LOCKED=self.pll_top_locked,
+                o_IOCLK=self.ioclk_top,
+                o_SERDESSTROBE=self.serdesstrobe_top
+            )
+
     def getIOs(self):
         """ add this classes additional IOs to the set """
         return Sp6Common.getIOs(self) | {
@@ -0,0 +1,100 @@
+"""
+Log the iserdes phase detectors of hello_LTC.py as a time series,
+to track LVDS alignment drift (against temperature) over days.
+
+Every row of the .csv is one phase detector snapshot, read in a single
+etherbone round trip (see common.readPd()):
+  unix time, sequence number, integration periods missed since the last
+  row, integration period, sample clock frequency, PD phase and IDELAY
+  position of each lane
+
+try:
+ python3 pd_log.py --every 10 --out measurements/pd_drift.csv
+"""
+from time import sleep, time
+import argparse
+import sys
+sys.path.append("../")
+from common import conLitexServer, closeLitexServer, readPd
+from scope_capture import unique_filename
+
+
+def logPd(r, f, every=1.0, seconds=None, verbose=True):
+    """
+    write a row to the open file `f` every `every` seconds, if there is a
+    new snapshot. Returns the number of rows written.
+    """
+    pd = readPd(r)
+    D = len(pd["phase"])
+    f.write(",".join(
+        ["t", "seq", "missed", "period", "f_sample"] +
+        ["phase_{:d}".format(i) for i in range(D)] +
+        ["tap_{:d}".format(i) for i in range(D)]
+    ) + "\n")
+    lastSeq = None
+    n = 0
+    tStart = time()
+    tNext = tStart
+    while seconds is None or time() - tStart < seconds:
+        pd = readPd(r)
+        t = time()
+        if pd["seq"] != lastSeq:
+            missed = 0 if lastSeq is None else \
+                ((pd["seq"] - lastSeq) & 0xFFFFFFFF) - 1
+            lastSeq = pd["seq"]
+            f.write(",".join(
+                ["{:.3f}".format(t), str(pd["seq"]), str(missed),
+                 str(pd["period"]), str(pd["f_sample"])] +
+                ["{:.6f}".format(v) for v in pd["phase"]] +
+                [str(v) for v in pd["tap"]]
+            ) + "\n")
+            f.flush()
+            n += 1
+            if verbose:
+                print("\r{:6d}  {:.6f} MHz  phase: {:}  tap: {:}      ".format(
+                    n, pd["f_sample"] / 1e6,
+                    " ".join("{:6.3f}".format(v) for v in pd["phase"]),
+                    " ".join("{:4d}".format(v) for v in pd["tap"])
+                ), end="")
+        tNext += every
+        sleep(max(tNext - time(), 0))
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--every", default=1.0, type=float, help="Seconds between rows"
+    )
+    parser.add_argument(
+        "--seconds", type=float, help="Stop after this many seconds (default: run until ctrl+c)"
+    )
+    parser.add_argument(
+        "--period", type=int, help="Set the PD integration period [sample clock cycles]"
+    )
+    parser.add_argument(
+        "--out", default="measurements/pd.csv", help="Output .csv file"
+    )
+    args = parser.parse_args()
+
+    r = conLitexServer()
+    if args.period is not None:
+        r.regs.lvds_pd_period_csr.write(args.period)
+    name = unique_filename(args.out)
+    print("logging to", name)
+    with open(name, "w") as f:
+        try:
+            n = logPd(r, f, args.every, args.seconds)
+        except KeyboardInterrupt:
+            n = None
+    print()
+    if n is not None:
+        print("wrote {:d} rows".format(n))
+    closeLitexServer(r)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,63 +4,58 @@ and then dumps 4096 samples in a buffer.
 Buffer is read out through litex_server (etherbone) periodically,
 fft'ed and plotted.
 """
-from litex.soc.tools.remote import RemoteClient
-from time import sleep
 from numpy import *
 from matplotlib.pyplot import *
 from matplotlib.animation import FuncAnimation
-from scipy.signal import periodogram
 import argparse
 import os
 sys.path.append("../")
 from common import *
+from spectrum import Spectrum
+from scope_capture import (
+    AcqThread, FrameBuffer, getSamples, initLtc, toFs, unique_filename
+)
 
 
-def getSamples(r, N=None):
-    """ why doesn't RemoteClient take care of chunking for me ??? """
-    if N is None:
-        N = r.mems.sample.size
-    o = r.mems.sample.base
-    r.regs.acq_trig_csr.write(0)
-    samples = []
-    while N:
-        temp = r.read(o, min(255, N))
-        o += len(temp) * 4  # in bytes!
-        N -= len(temp)
-        samples.append(temp)
-    samples = hstack(samples)
-    return samples / (1 << 15) - 1
+def minMax(x, y, nPix):
+    """
+    min / max envelope of y decimated to about nPix bins (2 points per bin),
+    for drawing long traces at the resolution of the screen.
+    Traces with less than 2 samples per pixel are passed through.
+    """
+    n = len(y) // nPix
+    if n < 2:
+        return x, y
+    nBins = len(y) // n
+    yy = y[:nBins * n].reshape(nBins, n)
+    yOut = empty(2 * nBins, dtype=y.dtype)
+    yOut[0::2] = yy.min(1)
+    yOut[1::2] = yy.max(1)
+    return repeat(x[:nBins * n:n], 2), yOut
 
 
-def ani(i, r, args, lt=None, lf=None, rollBuffer=None):
-    yVect = getSamples(r, args.N)
-    if rollBuffer is not None:
-        if len(rollBuffer) >= 32:
-            rollBuffer.pop(0)
-        rollBuffer.append(yVect)
-    f, Pxx = periodogram(
-        yVect,
-        args.fs,
-        window='hanning',
-        scaling='spectrum',
-        nfft=args.N * 2
+def ani(i, acq, spec, ch, xt, lt, lf, txt):
+    """
+    render the newest frame from the acquisition thread, if any
+    returns the changed artists for blitting
+    """
+    s = "capture: {:.1f} frames/s, dropped: {:d} / {:d}, no trigger: {:d}".format(
+        acq.rate, acq.nDropped, acq.nFrames, acq.nTimeouts
     )
-    spect = 10 * log10(Pxx) + 3
-    if lt:
-        lt.set_ydata(yVect)
-    if lf:
-        lf.set_ydata(spect)
-    return yVect, f, spect
-
-
-def unique_filename(file_name):
-    """ thank you stack overflow """
-    counter = 1
-    file_name_parts = os.path.splitext(file_name) # returns ('/path/file', '.ext')
-    while os.path.isfile(file_name):
-        file_name = file_name_parts[0] + '_' + str(counter) + file_name_parts[1]
-        counter += 1
-    return file_name
+    rec = acq.recorder
+    if rec is not None:
+        s = "recorded: {:d} (lost {:d}), ".format(
+            rec.nFrames, rec.nDropped
+        ) + s
+    txt.set_text(s)
+    slot = acq.get()
+    if slot is None:
+        return lt, lf, txt
+    yVect = toFs(slot[ch], acq.fBuf.fs[ch])
+    spec.add(yVect)
+    lt.set_data(*minMax(xt, yVect, int(lt.axes.bbox.width)))
+    lf.set_data(*minMax(spec.f / 1e6, spec.dbFs(), int(lf.axes.bbox.width)))
+    return lt, lf, txt
 
 
 def main():
@@ -71,48 +66,48 @@ def main():
     parser.add_argument(
         "--fs", default=120e6, type=float, help="ADC sample rate [MHz]. Must match hello_LTC.py setting."
     )
+    parser.add_argument(
+        "--window", default=8, type=int, help="Number of etherbone read requests in flight"
+    )
+    parser.add_argument(
+        "--avg", default="none", choices=Spectrum.MODES, help="Spectrum averaging mode"
+    )
+    parser.add_argument(
+        "--K", default=16, type=int, help="Number of frames for linear averaging"
+    )
+    parser.add_argument(
+        "--alpha", default=0.1, type=float, help="Weight of a new frame for exp. averaging"
+    )
+    parser.add_argument(
+        "--ch", default=0, type=int, help="Channel to display, index into LTCPhy.channels (all are recorded)"
+    )
     args = parser.parse_args()
-    rollBuffer = []  # last 32 blocks of samples for dumping to .npz file
+    spec = Spectrum(args.N, args.fs, mode=args.avg, K=args.K, alpha=args.alpha)
     # ----------------------------------------------
     #  Init hardware
     # ----------------------------------------------
     r = conLitexServer()
-    print("fs = {:6f} MHz, should be {:6f} MHz".format(
-        r.regs.lvds_f_sample_value.read() / 1e6, args.fs / 1e6
-    ))
-    r.regs.lvds_pd_period_csr.write(2**26)  # long integration period
-    r.regs.lvds_idelay_auto.write(1)  # Auto phase detector mode
-    print("Aligning bits: ", end="")
-    for i in range(8):
-        rVal = r.regs.lvds_clk_peek.read()
-        if rVal == 0x0F:
-            break
-        else:
-            r.regs.lvds_bitslip_csr.write(1)
-            print("*", end="")
-    if rVal != 0x0F:
-        raise RuntimeError("Bitslip error. Want 0x0F, got " + hex(rVal))
-    print("done!")
-    ltc_spi = LTC_SPI(r)
-    ltc_spi.set_ltc_reg(0, 0x80)   # Software reset
-    print("ADC word bits:")
-    for i in range(14):
-        tp = 1 << i
-        ltc_spi.setTp(tp)
-        print("{:016b} {:016b}".format(
-            tp, r.regs.lvds_data_peek.read()
-        ))
-    ltc_spi.set_ltc_reg(3, 0)  # Test pattern off
-    ltc_spi.set_ltc_reg(1, 0)  # Randomizer off
+    initLtc(r, args.fs)
+    fBuf = FrameBuffer(args.N, r.regs.acq_n_channels.read())
 
     # ----------------------------------------------
     #  Setup Matplotlib
     # ----------------------------------------------
     fig, axs = subplots(2, 1, figsize=(10, 6))
-    xVect = linspace(0, args.N / args.fs, args.N, endpoint=False)
-    yVect0, fVect, ampsVect = ani(0, r, args, rollBuffer=rollBuffer)
-    lt, = axs[0].plot(xVect * 1e9, yVect0, "-o")
-    lf, = axs[1].plot(fVect / 1e6, ampsVect)
+    xt = linspace(0, args.N / args.fs, args.N, endpoint=False) * 1e9
+    try:
+        getSamples(r, out=fBuf.next(), window=args.window)
+    except TimeoutError:
+        print("no trigger yet")
+    yVect0 = fBuf.latestFs()[args.ch]
+    spec.add(yVect0)
+    # markers only while there is room for them
+    fmt = "-o" if args.N <= axs[0].bbox.width / 4 else "-"
+    lt, = axs[0].plot(*minMax(xt, yVect0, int(axs[0].bbox.width)), fmt)
+    lf, = axs[1].plot(*minMax(spec.f / 1e6, spec.dbFs(), int(axs[1].bbox.width)))
+    txt = axs[1].text(
+        0.99, 0.97, "", ha="right", va="top", transform=axs[1].transAxes
+    )
     axs[0].set_xlabel("Time [ns]")
     axs[1].set_xlabel("Frequency [MHz]")
     axs[0].set_ylabel("ADC value [FS]")
@@ -124,18 +119,43 @@ def main():
         -1, 1, -0.001,
         '%1.3f'
     )
-    sfreq.on_changed(
-        lambda l: r.regs.acq_trig_level.write(int((l + 1) * (1 << 15)))
+    acq = AcqThread(r, fBuf, args.window)
+    def setTrigLevel(l):
+        with acq.linkLock:
+            r.regs.acq_trig_level.write(int((l + 1) * (1 << 15)))
+    sfreq.on_changed(setTrigLevel)
+    bRec = Button(axes([0.13, 0.01, 0.2, 0.05]), 'Record')
+    def record(x):
+        if acq.recorder is None:
+            fName = unique_filename("measurements/rec.json")
+            acq.startRecording(
+                os.path.splitext(fName)[0],
+                fs=args.fs,
+                N=args.N,
+                trig_level=sfreq.val,
+                format="offset_binary"
+            )
+            bRec.label.set_text("Stop")
+            print("recording to", fName)
+        else:
+            rec = acq.stopRecording()
+            bRec.label.set_text("Record")
+            print("wrote {:} frames to {:}.raw".format(rec.nFrames, rec.fName))
+    bRec.on_clicked(record)
+    rAvg = RadioButtons(
+        axes([0.88, 0.4, 0.11, 0.2]),
+        Spectrum.MODES,
+        active=Spectrum.MODES.index(args.avg)
+    )
+    rAvg.on_clicked(spec.setMode)
+    acq.start()
+    # blitting: only the traces and the status text get redrawn
+    fani = FuncAnimation(
+        fig, ani, interval=50, blit=True,
+        fargs=(acq, spec, args.ch, xt, lt, lf, txt)
     )
-    bDump = Button(axes([0.13, 0.01, 0.2, 0.05]), 'Dump .npz')
-    def dump(x):
-        fName = unique_filename("measurements/dump.npz")
-        savez_compressed(fName, dat=vstack(rollBuffer))
-        print("wrote {:} buffers to {:}".format(len(rollBuffer), fName))
-        rollBuffer.clear()
-    bDump.on_clicked(dump)
-    fani = FuncAnimation(fig, ani, interval=300, fargs=(r, args, lt, lf, rollBuffer))
     show()
+    acq.stop()
 
 
 if __name__ == '__main__':
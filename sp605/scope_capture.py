@@ -0,0 +1,507 @@
+"""
+Headless capture for hello_LTC.py: brings up the LTC2175 and streams
+frames to disk at full speed, without any GUI.
+Also hosts the readout helpers used by scope_app.py.
+
+try:
+ python3 scope_capture.py --N 4096 --frames 10000 --out measurements/night
+"""
+from time import perf_counter, time
+from threading import Thread, Lock
+from collections import deque
+import argparse
+import os
+import sys
+import numpy as np
+sys.path.append("../")
+from common import conLitexServer, closeLitexServer, readPipelined, readAddrs
+from common import LTC_SPI, getShadow
+from recorder import Recorder
+from adc_formats import FORMATS
+
+
+def sampleBases(r, C, bank=0, nBanks=1):
+    """ byte address of each of the C channel memories (in one bank) """
+    depth = r.mems.sample.size // 4 // C
+    L = depth // nBanks
+    return [r.mems.sample.base + (c * depth + bank * L) * 4 for c in range(C)]
+
+
+def acqBanks(r):
+    """ number of record banks per channel memory, read once per connection """
+    if not hasattr(r, "acqBanks"):
+        r.acqBanks = r.regs.acq_n_banks.read() if \
+            hasattr(r.regs, "acq_n_banks") else 1
+    return r.acqBanks
+
+
+def acqPack(r):
+    """ samples per 32 bit word in the sample memories, read once """
+    if not hasattr(r, "acqPack"):
+        r.acqPack = r.regs.acq_pack.read() if \
+            hasattr(r.regs, "acq_pack") else 1
+    return r.acqPack
+
+
+def readRecord(r, bases, out, window=8):
+    """
+    read len(bases) channels into the uint16 array `out` of shape
+    (channels, N). With 2 samples per word the words are read straight
+    into `out` viewed as uint32, the little endian host unpacks them.
+    """
+    if acqPack(r) == 2:
+        C, N = out.shape
+        readPipelined(r, bases, N // 2, out.view(np.uint32), window)
+        return out
+    return readPipelined(r, bases, out.shape[1], out, window)
+
+
+def _newOut(r, N):
+    C = r.regs.acq_n_channels.read()
+    if N is None:
+        N = r.mems.sample.size // 4 // C * acqPack(r) // acqBanks(r)
+    return np.zeros((C, N), dtype=np.uint16)
+
+
+def stopAcq(r, timeout=1.0):
+    """
+    clear continuous and wait until the running record is finished,
+    so the next mode starts on a record boundary
+    """
+    rs = getShadow(r)
+    rs.acq_continuous.write(0)
+    rs.flush()
+    t0 = perf_counter()
+    while r.regs.acq_trig_csr.read():
+        if perf_counter() - t0 > timeout:
+            raise TimeoutError("acquisition did not stop")
+
+
+def _setMode(r, pretrig=0, continuous=0, seg_shift=0, timeout=1.0):
+    """
+    acquisition mode CSRs, only written if they change.
+    A running acquisition is stopped before the mode changes.
+    """
+    rs = getShadow(r)
+    mode = dict(acq_pretrig=pretrig, acq_continuous=continuous)
+    if hasattr(r.regs, "acq_seg_shift"):
+        mode["acq_seg_shift"] = seg_shift
+    if any(rs.cache.get(k) != v for k, v in mode.items()):
+        stopAcq(r, timeout)
+    for k, v in mode.items():
+        rs.write(k, v)
+    rs.flush()
+
+
+def waitRecord(r, timeout=1.0, extra=()):
+    """
+    wait until a finished record is ready. Polls the acquisition state and
+    the registers in `extra` in one request each time.
+    Returns (bank, [values of extra])
+    """
+    addrs = [r.regs.acq_ready_valid.addr, r.regs.acq_bank_ready.addr]
+    addrs += [getattr(r.regs, n).addr for n in extra]
+    t0 = perf_counter()
+    while True:
+        vals = readAddrs(r, addrs)
+        if vals[0]:
+            return int(vals[1]), [int(v) for v in vals[2:]]
+        if perf_counter() - t0 > timeout:
+            raise TimeoutError("no record")
+
+
+def getSamples(r, N=None, out=None, window=8, timeout=1.0):
+    """
+    arm the trigger and read N raw (offset binary) samples of all channels
+    from the acquisition memories into the uint16 array `out` of shape
+    (channels, N), in one pipelined readout with `window` read requests
+    in flight at once
+
+    With ping-pong banks, the acquisition runs continuously and this
+    reads the newest finished record while the next one is captured.
+    """
+    if out is None:
+        out = _newOut(r, N)
+    C, N = out.shape
+    nBanks = acqBanks(r)
+    if nBanks == 1:
+        r.regs.acq_trig_csr.write(0)
+        return readRecord(r, sampleBases(r, C), out, window)
+    _setMode(r, continuous=1, timeout=timeout)
+    busy, valid = readAddrs(r, [
+        r.regs.acq_trig_csr.addr, r.regs.acq_ready_valid.addr
+    ])
+    if not busy and not valid:
+        r.regs.acq_trig_csr.write(0)
+    bank, _ = waitRecord(r, timeout)
+    readRecord(r, sampleBases(r, C, bank, nBanks), out, window)
+    r.regs.acq_release.write(0)
+    return out
+
+
+def unroll(raw, trig_addr, post_count):
+    """
+    rotate a pre-trigger (circular buffer) record in place, such that the
+    oldest sample comes first and the trigger sample is at
+    N - post_count - 1
+    """
+    N = raw.shape[-1]
+    raw[:] = np.roll(raw, -((trig_addr + post_count + 1) % N), axis=-1)
+    return raw
+
+
+def getSamplesPretrig(r, out=None, window=8, timeout=1.0):
+    """
+    like getSamples() in pre-trigger mode: arm, wait for the trigger
+    and return the unrolled records of all channels, the full record length
+    """
+    if out is None:
+        out = _newOut(r, None)
+    C, N = out.shape
+    _setMode(r, pretrig=1, timeout=timeout)
+    # drop an old record, then arm
+    r.regs.acq_release.write(0)
+    r.regs.acq_trig_csr.write(0)
+    bank, (trig_addr, post_count) = waitRecord(
+        r, timeout, ("acq_trig_addr", "acq_post_count")
+    )
+    readRecord(r, sampleBases(r, C, bank, acqBanks(r)), out, window)
+    r.regs.acq_release.write(0)
+    return unroll(out, trig_addr, post_count)
+
+
+def getSegments(r, K, window=8, timeout=1.0):
+    """
+    segmented acquisition: arm once, capture K (power of 2) triggers and
+    read back all of them. Returns the raw samples, shape
+    (channels, K, samples per segment) and the sample clock count at
+    each segment trigger, uint64 array of length K.
+    """
+    if not hasattr(r, "acqMaxSegments"):
+        r.acqMaxSegments = r.regs.acq_max_segments.read() if \
+            hasattr(r.regs, "acq_max_segments") else 1
+    if K < 1 or K & (K - 1) or K > r.acqMaxSegments:
+        raise ValueError("K must be a power of 2 <= {:d}, not {:}".format(
+            r.acqMaxSegments, K
+        ))
+    out = _newOut(r, None)
+    C, N = out.shape
+    # seg_shift and arming need an idle acquisition, also when the mode
+    # is unchanged (a previous call may have left a record running)
+    stopAcq(r, timeout)
+    _setMode(r, seg_shift=K.bit_length() - 1, timeout=timeout)
+    r.regs.acq_release.write(0)
+    r.regs.acq_trig_csr.write(0)
+    bank, _ = waitRecord(r, timeout)
+    readRecord(r, sampleBases(r, C, bank, acqBanks(r)), out, window)
+    offs = bank * r.acqMaxSegments * 4
+    ts = readPipelined(
+        r, [r.bases.acq_ts_lo + offs, r.bases.acq_ts_hi + offs], K
+    ).astype(np.uint64)
+    r.regs.acq_release.write(0)
+    return out.reshape(C, K, N // K), ts[0] | (ts[1] << np.uint64(32))
+
+
+def getAverage(r, n_avg, window=8, timeout=10.0):
+    """
+    sum n_avg triggered records on the FPGA (hello_LTC Averager) and read
+    back only the result. Returns the mean records in raw (offset binary)
+    units as float64 array of shape (channels, record length), and the
+    number of records averaged.
+    """
+    # 16 bit samples in 32 bit accumulators
+    if not 1 <= n_avg < 1 << 16:
+        raise ValueError("n_avg must be 1 .. 65535, not {:}".format(n_avg))
+    C = r.regs.acq_n_channels.read()
+    L = r.regs.avg_length.read()
+    # start on a record boundary: let a running acquisition finish
+    stopAcq(r, timeout)
+    _setMode(r)
+    t0 = perf_counter()
+    rs = getShadow(r)
+    mode = rs.acq_stream_mode.read()
+    try:
+        rs.avg_n_avg.write(n_avg)
+        rs.acq_stream_mode.write(1)
+        rs.flush()
+        r.regs.avg_start.write(0)
+        _setMode(r, continuous=1, timeout=timeout)
+        r.regs.acq_trig_csr.write(0)
+        addrs = [r.regs.avg_busy.addr, r.regs.avg_n_done.addr]
+        while True:
+            busy, n = readAddrs(r, addrs)
+            if not busy:
+                break
+            if perf_counter() - t0 > timeout:
+                raise TimeoutError("averaged only {:d} records".format(int(n)))
+    finally:
+        _setMode(r, timeout=timeout)
+        rs.acq_stream_mode.write(mode)
+        rs.flush()
+        # records captured while averaging were never read
+        r.regs.acq_release.write(0)
+    acc = readPipelined(
+        r, [r.mems.avg.base + c * L * 4 for c in range(C)], L, window=window
+    )
+    return acc / int(n), int(n)
+
+
+def toFs(raw, out=None):
+    """
+    convert raw offset binary samples to full scale, -1 <= val < 1
+    writes into the float32 array `out` if given
+    """
+    return FORMATS["offset_binary"].toFloat(raw, out)
+
+
+class FrameBuffer:
+    """
+    ring buffer of the last M raw frames of C channels with N uint16
+    samples each. Preallocated once, the readout writes straight into
+    the next slot.
+    """
+    def __init__(self, N, C=1, M=32):
+        self.raw = np.zeros((M, C, N), dtype=np.uint16)
+        self.fs = np.zeros((C, N), dtype=np.float32)
+        self.n = 0  # total number of frames written
+        self.lock = Lock()
+
+    def next(self):
+        """ returns the slot to write the next frame into """
+        with self.lock:
+            slot = self.raw[self.n % self.raw.shape[0]]
+            self.n += 1
+        return slot
+
+    def latest(self):
+        """ most recent raw frame """
+        return self.raw[(self.n - 1) % self.raw.shape[0]]
+
+    def latestFs(self):
+        """ most recent frame in full scale (converted into a reused buffer) """
+        return toFs(self.latest(), self.fs)
+
+
+class AcqThread(Thread):
+    """
+    producer thread: arms the trigger and reads frames into `fBuf`
+    as fast as the link allows. Slots of finished frames go into a
+    bounded queue which drops the oldest ones if the GUI can't keep up.
+    If `recorder` is set, every captured frame is also streamed to disk.
+    Reads which time out (no trigger) are counted in nTimeouts.
+
+    Hold `linkLock` (the lock of the shared connection) when accessing
+    `r` from another thread.
+    """
+    def __init__(self, r, fBuf, window=8, maxlen=4):
+        Thread.__init__(self, daemon=True)
+        self.r = r
+        self.fBuf = fBuf
+        self.window = window
+        self.queue = deque(maxlen=maxlen)
+        self.queueLock = Lock()
+        self.linkLock = r.lock
+        self.running = True
+        self.recorder = None
+        self.nFrames = 0    # frames captured
+        self.nDropped = 0   # frames captured but never consumed
+        self.nTimeouts = 0  # getSamples() calls without a trigger
+        self.rate = 0.0     # captured frames / s
+
+    def run(self):
+        t0 = perf_counter()
+        n0 = 0
+        while self.running:
+            slot = self.fBuf.next()
+            try:
+                with self.linkLock:
+                    getSamples(self.r, out=slot, window=self.window)
+            except TimeoutError:
+                self.nTimeouts += 1
+                continue
+            rec = self.recorder
+            if rec is not None:
+                rec.put(slot, time())
+            with self.queueLock:
+                if len(self.queue) == self.queue.maxlen:
+                    self.nDropped += 1
+                self.queue.append(slot)
+            self.nFrames += 1
+            t = perf_counter()
+            if t - t0 >= 1.0:
+                self.rate = (self.nFrames - n0) / (t - t0)
+                t0 = t
+                n0 = self.nFrames
+
+    def get(self):
+        """ returns the newest frame (or None), older ones are dropped """
+        with self.queueLock:
+            if len(self.queue) == 0:
+                return None
+            slot = self.queue.pop()
+            self.nDropped += len(self.queue)
+            self.queue.clear()
+        return slot
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.stopRecording()
+
+    def startRecording(self, name, **meta):
+        rec = Recorder(name, self.fBuf.raw.shape[1:], **meta)
+        rec.start()
+        self.recorder = rec
+        return rec
+
+    def stopRecording(self):
+        rec = self.recorder
+        self.recorder = None
+        if rec is not None:
+            rec.stop()
+        return rec
+
+
+def unique_filename(file_name):
+    """ thank you stack overflow """
+    counter = 1
+    file_name_parts = os.path.splitext(file_name) # returns ('/path/file', '.ext')
+    while os.path.isfile(file_name):
+        file_name = file_name_parts[0] + '_' + str(counter) + file_name_parts[1]
+        counter += 1
+    return file_name
+
+
+# LTC2175 register setup after reset
+def initLtc(r, fs=None, verbose=True):
+    """
+    bring-up of the LTC2175 demonstrator: phase detector / bit alignment,
+    ADC reset, test-pattern check, test pattern and randomizer off
+    """
+    rs = getShadow(r)
+    if fs is not None:
+        print("fs = {:6f} MHz, should be {:6f} MHz".format(
+            rs.lvds_f_sample_value.read() / 1e6, fs / 1e6
+        ))
+    rs.lvds_pd_period_csr.write(2**26)  # long integration period
+    rs.lvds_idelay_auto.write(1)  # Auto phase detector mode
+    print("Aligning bits: ", end="")
+    for i in range(8):
+        rVal = rs.lvds_clk_peek.read()
+        if rVal == 0x0F:
+            break
+        else:
+            rs.lvds_bitslip_csr.strobe()
+            print("*", end="")
+    if rVal != 0x0F:
+        raise RuntimeError("Bitslip error. Want 0x0F, got " + hex(rVal))
+    print("done!")
+    ltc_spi = LTC_SPI(r)
+    ltc_spi.set_ltc_reg(0, 0x80)   # Software reset
+    if verbose:
+        print("ADC word bits:")
+        for i in range(14):
+            tp = 1 << i
+            ltc_spi.setTp(tp)
+            print("{:016b} {:016b}".format(
+                tp, rs.lvds_data_peek.read()
+            ))
+    bad = ltc_spi.program(LTC_SPI.INIT)
+    if bad:
+        print("LTC2175 registers did not stick (wanted, got):", bad)
+    return ltc_spi
+
+
+def capture(r, rec, N, C=1, window=8, nFrames=None, seconds=None):
+    """
+    read frames of C channels back to back into the Recorder `rec` until
+    `nFrames` frames or `seconds` have passed.
+    Returns (frames, elapsed time, reads which timed out)
+    """
+    fBuf = FrameBuffer(N, C, 4)
+    n = nTimeouts = 0
+    t0 = perf_counter()
+    try:
+        while True:
+            if nFrames is not None and n >= nFrames:
+                break
+            if seconds is not None and perf_counter() - t0 >= seconds:
+                break
+            slot = fBuf.next()
+            try:
+                getSamples(r, out=slot, window=window)
+            except TimeoutError:
+                nTimeouts += 1
+                continue
+            rec.put(slot, time())
+            n += 1
+    except KeyboardInterrupt:
+        pass
+    return n, perf_counter() - t0, nTimeouts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--N", default=4096, type=int, help="Number of samples per acquisition"
+    )
+    parser.add_argument(
+        "--fs", default=120e6, type=float, help="ADC sample rate [MHz]. Must match hello_LTC.py setting."
+    )
+    parser.add_argument(
+        "--window", default=8, type=int, help="Number of etherbone read requests in flight"
+    )
+    parser.add_argument(
+        "--frames", type=int, help="Stop after this many frames"
+    )
+    parser.add_argument(
+        "--seconds", type=float, help="Stop after this many seconds"
+    )
+    parser.add_argument(
+        "--trig_level", default=-0.001, type=float, help="Trigger level [FS]"
+    )
+    parser.add_argument(
+        "--out", default="measurements/rec", help="Recording base file name"
+    )
+    parser.add_argument(
+        "--skip_init", action="store_true", help="Don't re-initialize the ADC"
+    )
+    args = parser.parse_args()
+    if args.frames is None and args.seconds is None:
+        parser.error("need --frames and / or --seconds (ctrl+c stops early)")
+
+    r = conLitexServer()
+    if not args.skip_init:
+        initLtc(r, args.fs, verbose=False)
+    r.regs.acq_trig_level.write(int((args.trig_level + 1) * (1 << 15)))
+    C = r.regs.acq_n_channels.read()
+
+    name = os.path.splitext(unique_filename(args.out + ".json"))[0]
+    rec = Recorder(
+        name, (C, args.N),
+        fs=args.fs,
+        N=args.N,
+        trig_level=args.trig_level,
+        format="offset_binary"
+    )
+    rec.start()
+    print("capturing to", name)
+    try:
+        n, dt, nTimeouts = capture(
+            r, rec, args.N, C, args.window, args.frames, args.seconds
+        )
+    finally:
+        rec.stop()
+        closeLitexServer(r)
+    if nTimeouts:
+        print("{:d} reads timed out (no trigger)".format(nTimeouts))
+    print("{:d} frames of {:d} channels in {:.2f} s: {:.1f} frames/s, {:.3f} MS/s, {:.3f} MB/s".format(
+        n, C, dt, n / dt, n * C * args.N / dt / 1e6, n * C * args.N * 2 / dt / 1e6
+    ))
+    print("wrote {:d} frames, {:d} lost in the disk queue".format(
+        rec.nFrames, rec.nDropped
+    ))
+
+
+if __name__ == '__main__':
+    main()
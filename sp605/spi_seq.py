@@ -0,0 +1,239 @@
+"""
+SPI init sequencer for the LTC2175
+
+Replays a table of 16 bit SPI write words from block RAM, right after
+FPGA configuration (reset) and on every write to the `start` CSR.
+Each word is (register address << 8) | value, see LTC_SPI.write_word().
+The default table is LTC_SPI.INIT.
+The table is a CSR memory, the host can rewrite it in one burst.
+
+While running, the sequencer drives the SPI pads, otherwise
+`pads_master` (give it to the SPIMaster and call connect_master()) is
+passed through.
+
+try:
+ python3 spi_seq.py <build / sim>
+"""
+from sys import argv, path
+from migen import *
+from migen.fhdl.specials import Tristate
+from litex.soc.interconnect.csr import *
+path.append("..")
+from common import LTC_SPI
+
+
+def ltc_words(table):
+    """ [(address or name, value), ...] --> list of 16 bit SPI write words """
+    return [LTC_SPI.write_word(reg, val) for reg, val in table]
+
+
+class SpiSequencer(Module, AutoCSR):
+    pads_layout = [("cs_n", 1), ("clk", 1), ("mosi", 1), ("miso", 1)]
+
+    def __init__(
+        self, pads=None, sys_clk_freq=125e6, spi_clk_freq=2e6,
+        N_WORDS=32, init=LTC_SPI.INIT
+    ):
+        if pads is None:
+            pads = Record(self.pads_layout)
+        self.pads = pads
+        # connect these to the SPIMaster instead of the real pads
+        self.pads_master = Record(self.pads_layout)
+        # high while replaying the table
+        self.busy = Signal()
+
+        # writing `start` replays the table (value does not matter)
+        self.start = CSR()
+        # number of valid words in the table
+        self.length = CSRStorage(8, reset=len(init))
+        # size of the table
+        self.n_words = CSRStatus(8, reset=N_WORDS)
+        # how many times the table has been replayed since reset
+        self.runs = CSRStatus(16)
+        self.table = Memory(16, N_WORDS, init=ltc_words(init))
+        self.specials += self.table
+
+        ###
+
+        rd = self.table.get_port()
+        self.specials += rd
+
+        # half a SPI clock period
+        div = max(int(sys_clk_freq / spi_clk_freq / 2), 1)
+        div_cnt = Signal(max=div + 1)
+        tick = Signal()
+        self.sync += If(tick,
+            div_cnt.eq(div - 1)
+        ).Else(
+            div_cnt.eq(div_cnt - 1)
+        )
+        self.comb += tick.eq(div_cnt == 0)
+
+        # replay once after reset
+        pending = Signal(reset=1)
+        self.sync += If(self.start.re, pending.eq(1))
+
+        idx = Signal(max=N_WORDS + 1)
+        sr = Signal(16)
+        nbit = Signal(4)
+        cs_n = Signal(reset=1)
+        clk = Signal()
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            If(pending & ~self.start.re,
+                NextValue(pending, 0),
+                NextValue(idx, 0),
+                NextState("FETCH")
+            )
+        )
+        fsm.act("FETCH",
+            NextState("LOAD")
+        )
+        fsm.act("LOAD",
+            # never run past the end of the table
+            If((idx >= self.length.storage) | (idx >= N_WORDS),
+                NextValue(self.runs.status, self.runs.status + 1),
+                NextState("IDLE")
+            ).Else(
+                NextValue(sr, rd.dat_r),
+                NextValue(nbit, 0),
+                NextValue(cs_n, 0),
+                NextState("CS")
+            )
+        )
+        # SPI mode 0: mosi changes on the falling edge, sampled on rising
+        fsm.act("CS",
+            If(tick, NextValue(clk, 1), NextState("CLK_HI"))
+        )
+        fsm.act("CLK_HI",
+            If(tick,
+                NextValue(clk, 0),
+                NextValue(sr, sr << 1),
+                NextValue(nbit, nbit + 1),
+                If(nbit == 15,
+                    NextState("END")
+                ).Else(
+                    NextState("CLK_LO")
+                )
+            )
+        )
+        fsm.act("CLK_LO",
+            If(tick, NextValue(clk, 1), NextState("CLK_HI"))
+        )
+        fsm.act("END",
+            If(tick,
+                NextValue(cs_n, 1),
+                NextValue(idx, idx + 1),
+                NextState("GAP")
+            )
+        )
+        fsm.act("GAP",
+            If(tick, NextState("FETCH"))
+        )
+        self.comb += [
+            rd.adr.eq(idx),
+            self.busy.eq(~fsm.ongoing("IDLE")),
+            self.pads_master.miso.eq(pads.miso),
+            If(self.busy,
+                pads.cs_n.eq(cs_n),
+                pads.clk.eq(clk),
+                pads.mosi.eq(sr[15])
+            ).Else(
+                pads.cs_n.eq(self.pads_master.cs_n),
+                pads.clk.eq(self.pads_master.clk),
+                pads.mosi.eq(self.pads_master.mosi)
+            )
+        ]
+        # so the host can wait for the sequencer before using the SPIMaster
+        self.busy_csr = CSRStatus()
+        self.comb += self.busy_csr.status.eq(self.busy)
+
+    def connect_master(self, master):
+        """
+        spi.SPIMaster drives its pads through TSTriples, on pads_master
+        these would be tristate nets inside the FPGA. Replace them by
+        plain logic: a released output (offline) idles at cs_n = 1,
+        clk = mosi = 0 and reads back what is on pads_master.
+
+        Call it right after creating the master. It relies on migen
+        internals: the Tristate specials are taken out of the private
+        _fragment.specials of `master` and its _submodules, before the
+        design is finalized. A master without TSTriples is left alone.
+        """
+        names = {
+            id(getattr(self.pads_master, n)): n
+            for n, _ in self.pads_layout if n != "miso"
+        }
+        for m, ts in _tristates(master):
+            name = names.get(id(ts.target))
+            if name is None:
+                continue
+            m._fragment.specials.remove(ts)
+            idle = (1 << len(ts.target)) - 1 if name == "cs_n" else 0
+            self.comb += [
+                ts.target.eq(Mux(ts.oe, ts.o, idle)),
+                ts.i.eq(ts.target)
+            ]
+
+
+def _tristates(m):
+    """ (module, Tristate special) pairs of m and its submodules """
+    for s in list(m._fragment.specials):
+        if isinstance(s, Tristate):
+            yield m, s
+    for _, sub in m._submodules:
+        yield from _tristates(sub)
+
+
+def spi_monitor(dut, words):
+    """ decode the SPI words on the pads """
+    # idle level of the SPIMaster
+    yield dut.pads_master.cs_n.eq(1)
+    yield
+    while len(words) < len(LTC_SPI.INIT):
+        word = 0
+        while (yield dut.pads.cs_n):
+            yield
+        for i in range(16):
+            while not (yield dut.pads.clk):
+                yield
+            word = (word << 1) | (yield dut.pads.mosi)
+            while (yield dut.pads.clk):
+                yield
+        while not (yield dut.pads.cs_n):
+            yield
+        print("SPI word: {:04x}".format(word))
+        words.append(word)
+
+
+def main():
+    dut = SpiSequencer(sys_clk_freq=100e6, spi_clk_freq=10e6)
+    if "build" in argv:
+        ''' generate a .v file for simulation with Icarus / general usage '''
+        from migen.fhdl.verilog import convert
+        convert(
+            dut,
+            ios={
+                dut.pads.cs_n, dut.pads.clk, dut.pads.mosi, dut.pads.miso,
+                dut.pads_master.cs_n, dut.pads_master.clk,
+                dut.pads_master.mosi, dut.pads_master.miso,
+                dut.busy
+            },
+            display_run=True
+        ).write(argv[0].replace(".py", ".v"))
+    if "sim" in argv:
+        words = []
+        run_simulation(
+            dut,
+            spi_monitor(dut, words),
+            vcd_name=argv[0].replace(".py", ".vcd")
+        )
+        assert words == ltc_words(LTC_SPI.INIT), words
+
+
+if __name__ == '__main__':
+    if len(argv) <= 1:
+        print(__doc__)
+        exit(-1)
+    main()
@@ -0,0 +1,120 @@
+"""
+Incremental power spectrum of ADC frames with optional averaging
+
+A single frame gives the same result as
+  periodogram(x, fs, window='hanning', scaling='spectrum', nfft=nfft)
+but the window, scaling and all buffers are set up once per N.
+
+averaging modes:
+  none:   latest frame only
+  linear: mean over the last K frames
+  exp:    exponential moving average, avg += alpha * (new - avg)
+  peak:   peak hold, maximum over all frames since reset()
+"""
+import inspect
+import numpy as np
+from scipy.signal import get_window
+
+# numpy >= 2.0 can write the FFT result into a preallocated array
+_RFFT_OUT = "out" in inspect.signature(np.fft.rfft).parameters
+
+
+class Spectrum:
+    MODES = ("none", "linear", "exp", "peak")
+
+    def __init__(
+        self, N, fs, nfft=None, mode="none", K=16, alpha=0.1, window="hann"
+    ):
+        if mode not in Spectrum.MODES:
+            raise ValueError("mode must be one of " + str(Spectrum.MODES))
+        self.N = N
+        self.fs = fs
+        self.nfft = 2 * N if nfft is None else nfft
+        self.mode = mode
+        self.K = K
+        self.alpha = alpha
+        self.f = np.fft.rfftfreq(self.nfft, 1 / fs)
+        nf = len(self.f)
+        # same periodic window as periodogram(..., window='hanning')
+        if window == "hanning":
+            window = "hann"
+        self.win = get_window(window, N)
+        # scaling='spectrum' and one-sided: double all bins but DC / Nyquist
+        self.scale = np.full(nf, 2 / self.win.sum()**2)
+        self.scale[0] /= 2
+        if self.nfft % 2 == 0:
+            self.scale[-1] /= 2
+        # preallocated work buffers
+        self._xw = np.zeros(N)
+        self._X = np.zeros(nf, dtype=complex)
+        self._pxx = np.zeros(nf)
+        self._hist = np.zeros((K, nf))  # last K spectra for linear mode
+        self._sum = np.zeros(nf)
+        self.avg = np.zeros(nf)
+        self.db = np.zeros(nf)
+        self.reset()
+
+    def reset(self):
+        """ forget all averaged frames """
+        self.n = 0
+        self._hist[:] = 0
+        self._sum[:] = 0
+
+    def setMode(self, mode):
+        if mode not in Spectrum.MODES:
+            raise ValueError("mode must be one of " + str(Spectrum.MODES))
+        self.mode = mode
+        self.reset()
+
+    def single(self, x):
+        """ power spectrum of one frame, returns a reused array """
+        np.subtract(x, np.mean(x), out=self._xw)  # detrend='constant'
+        self._xw *= self.win
+        if _RFFT_OUT:
+            np.fft.rfft(self._xw, self.nfft, out=self._X)
+        else:
+            self._X[:] = np.fft.rfft(self._xw, self.nfft)
+        np.abs(self._X, out=self._pxx)
+        self._pxx **= 2
+        self._pxx *= self.scale
+        return self._pxx
+
+    def blockSum(self, frames):
+        """
+        sum of the power spectra of a block of frames (time along the last
+        axis, summed over the first), vectorized, allocates its own buffers
+        """
+        x = frames - np.mean(frames, -1, keepdims=True)
+        x *= self.win
+        P = np.abs(np.fft.rfft(x, self.nfft))
+        P **= 2
+        return P.sum(0) * self.scale
+
+    def add(self, x):
+        """ add a frame to the average, returns the averaged spectrum """
+        pxx = self.single(x)
+        if self.mode == "none" or self.n == 0:
+            self.avg[:] = pxx
+        elif self.mode == "exp":
+            self.avg += self.alpha * (pxx - self.avg)
+        elif self.mode == "peak":
+            np.maximum(self.avg, pxx, out=self.avg)
+        if self.mode == "linear":
+            # running sum over a ring of the last K spectra
+            row = self._hist[self.n % self.K]
+            self._sum -= row
+            row[:] = pxx
+            self._sum += row
+            np.divide(self._sum, min(self.n + 1, self.K), out=self.avg)
+        self.n += 1
+        return self.avg
+
+    def dbFs(self):
+        """
+        averaged spectrum in dB_FS
+        +3 dB such that a full scale sine reads 0 dB_FS
+        """
+        np.log10(self.avg, out=self.db)
+        self.db *= 10
+        self.db += 3
+        return self.db